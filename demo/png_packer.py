@@ -14,6 +14,7 @@ See http://www.w3.org/TR/PNG/ for the full spec of the PNG format.
 
 import sys
 import os
+import mmap
 import argparse
 import dumpy.config as dc
 
@@ -21,7 +22,15 @@ import dumpy.config as dc
 # to ``dumpy.config.ENDIAN`` **before** importing ``dumpy.types``.
 # See the documentation of the ``struct`` module for supported endians.
 dc.ENDIAN = '>'     # Big endian for PNG
+
+# Nested composite objects normally have a ``parent`` attribute, which is a
+# weakref to the upper level object. We don't use it here (see
+# ``get_unknown_data_count(...)`` below), so we save the time and memory
+# spent on creating it for every chunk.
+dc.PARENT_REFS = False
 import dumpy.types as dt
+import dumpy.pipeline as dp
+from dumpy.fileio import copy_range, append_records
 
 
 # ================== Data Structures ==================
@@ -70,7 +79,10 @@ class PNGSignature(dict, metaclass=dt.DumpyMeta):
         # Here we have a field named ``signature``, with a size of 8 bytes.
         # We can specify a validator callback for a field. When unpacking
         # binary data, the validator will be called with the unpacked field
-        # value.
+        # value. ``dumpy.config.VALIDATION`` (or the ``validation`` argument
+        # of ``unpack_from(...)``) can postpone the validators to the end of
+        # unpacking, to report all the failures at once, or turn them off
+        # for trusted data.
         dt.field('signature', dt.UInt8, count=8, validator=check_png_signature),
     )
 
@@ -115,20 +127,21 @@ class DataDEAD(dict, metaclass=dt.DumpyMeta):
     )
 
 
-def get_unknown_data_count(obj):
+# Callables marked with ``dumpy.types.contextual(...)`` receive a second
+# argument, a ``dumpy.types.ParseContext``, which tells where the object is
+# in the object tree being packed or unpacked: ``ctx.parent`` is the upper
+# level object, ``ctx.root`` the top level one, and ``ctx.offset`` the
+# current offset in the buffer.
+@dt.contextual
+def get_unknown_data_count(obj, ctx):
     """Used by ``DataUnknown`` to determine how many data bytes are there in
     the ``data`` field."""
 
-    # All ``Dumpy`` composite objects have a ``parent`` attribute, which is a
-    # weakref to the upper level object. The ``parent`` is ``None`` if the
-    # object have no parent.
-
     # We are dealing with ``DataUnknown`` objects here, so the parent is a
     # ``PNGChunk`` object. The length of the ``data`` field in ``DataUnknown``
     # is determined by the ``length`` field in ``PNGChunk``.
     # See http://www.w3.org/TR/PNG/#5Chunk-layout
-    chunk_obj = obj.parent()
-    return chunk_obj['length']
+    return ctx.parent['length']
 
 
 class DataUnknown(dict, metaclass=dt.DumpyMeta):
@@ -139,6 +152,11 @@ class DataUnknown(dict, metaclass=dt.DumpyMeta):
     )
 
 
+# ``dumpy.types.depends(...)`` declares which fields a callable reads. This
+# lets ``PNGChunk.skip(...)`` find the end of a chunk by decoding only the
+# ``type`` field (and the ``length`` field needed by ``DataUnknown``),
+# instead of the whole chunk.
+@dt.depends('type')
 def get_chunk_data_type(obj):
     """Used by PNGChunk to determine which class to use when dealing with
     chunk data."""
@@ -178,18 +196,16 @@ class PNGChunk(dict, metaclass=dt.DumpyMeta):
     }
 
 
-def check_chunk_continue(obj):
-    if len(obj['chunks']) <= 0:
-        return True
-    else:
-        last_chunk_type = bytes(obj['chunks'][-1]['type'])
-        return last_chunk_type != b'IEND'
-
-
 class PNGFile(dict, metaclass=dt.DumpyMeta):
     __field_specs__ = (
         dt.field('signature', PNGSignature),
-        dt.field('chunks', PNGChunk, count=check_chunk_continue),
+
+        # The chunk list ends with the ``IEND`` chunk. Instead of writing a
+        # boolean count callable that checks the last chunk after every
+        # element, we use a declarative terminator. Terminators for single
+        # bytes (``dumpy.types.until_byte(...)``) and for the end of the
+        # buffer (``dumpy.types.until_eof()``) are also available.
+        dt.field('chunks', PNGChunk, count=dt.until_field('type', b'IEND')),
     )
 
 
@@ -216,7 +232,15 @@ def read_png(png_file):
         return (png, data)
 
 
-def pack_file_into_dead_chunk(extra_file):
+def read_extra_file(extra_file):
+    print('Packing {} ....'.format(repr(extra_file.name)))
+    with extra_file:
+        return (extra_file.name, extra_file.read())
+
+
+def pack_file_into_dead_chunk(name_and_data):
+    file_name, file_data = name_and_data
+
     dead = DataDEAD()
     # Field types are checked (partially) when assigning field values:
     # 1. A field with a count larger than 1, or a dynamic count, can only be
@@ -227,14 +251,35 @@ def pack_file_into_dead_chunk(extra_file):
     # 3. A field with a count smaller than 1 cannot be assigned any value.
     #    Trying to do so will cause a ValueError. Dynamic count functions may
     #    return 0 to indicate that the field doesn't exist.
-    dead['name'] = os.path.split(extra_file.name)[1].encode()
-    dead['data'] = extra_file.read()
+    dead['name'] = os.path.split(file_name)[1].encode()
+    dead['data'] = file_data
 
     chunk = PNGChunk()
     chunk['type'] = b'deAd'
     chunk['data'] = dead
 
-    return chunk
+    # ``pack_iov`` returns a list of buffers instead of a single ``bytes``
+    # object. The file data get a buffer of their own, so they are not
+    # copied again to be joined with the chunk headers.
+    return chunk.pack_iov()
+
+
+def iter_chunk_offsets(data):
+    """Yields the offset of every chunk in a PNG stream, without decoding
+    the chunks."""
+
+    # The ``type`` field comes before the first dynamically sized field,
+    # so its offset in a chunk is known statically and we can slice it
+    # from the mapped file directly. See ``PNGChunk.offset_of(...)``.
+    type_offset = PNGChunk.offset_of('type')
+    offset = PNGSignature.__fixed_size__
+    while True:
+        yield offset
+        type_start = offset + type_offset
+        chunk_type = data[type_start:type_start + 4]
+        offset = PNGChunk.skip(data, offset)
+        if chunk_type == b'IEND':
+            break
 
 
 def list_chunks(args):
@@ -266,18 +311,27 @@ def pack_files(args):
     if args.output is None:
         raise RuntimeError('Output file not specified.')
 
-    png, extra_data = read_png(args.png_file)
-
     files_to_pack = flatten_list(args.pack)
-    with open(args.output, 'xb') as out_file:
-        for f in files_to_pack:
-            print('Packing {} ....'.format(repr(f.name)))
-            with f:
-                new_chunk = pack_file_into_dead_chunk(f)
-                png['chunks'].insert(-1, new_chunk)
-
-        out_file.write(png.pack())
-        out_file.write(extra_data)
+    with args.png_file as png_file, open(args.output, 'x+b') as out_file:
+        # The original PNG is copied as is, inside the kernel, without
+        # decoding any of its chunks.
+        copy_range(png_file, out_file, 0, os.fstat(png_file.fileno()).st_size)
+
+        # Reading the files and building the ``deAd`` chunks run
+        # concurrently. The stages are connected by bounded queues, so only
+        # a few files are kept in memory at any time, and the chunks come
+        # out in order.
+        packer = dp.Pipeline(
+            dp.Stage(read_extra_file, workers=4),
+            dp.Stage(pack_file_into_dead_chunk, workers=2))
+
+        # The new chunks go where the ``IEND`` chunk was. ``append_records``
+        # finds it with ``PNGFile.terminator_offset(...)``, which only
+        # decodes the chunk types, then writes the ``IEND`` chunk and any
+        # trailing bytes back after the new chunks. The existing chunks are
+        # left alone, so this works the same way when appending to a file
+        # in place.
+        append_records(PNGFile, out_file, 'chunks', packer.run(files_to_pack))
 
     print('Done.')
 
@@ -292,18 +346,46 @@ def extract_files(args):
     if not os.path.isdir(args.output):
         raise RuntimeError('\'--output\' argument is not a directory.')
 
-    png, extra_data = read_png(args.png_file)
-
     files_to_extract = list(flatten_list(args.extract))
-    for c in png['chunks']:
-        if isinstance(c['data'], DataDEAD):
-            file_name = bytes(c['data']['name']).decode()
+
+    # The PNG file is mapped into memory instead of being read. Only the
+    # chunk headers and file names get decoded, and the embedded file
+    # contents are copied to the output files inside the kernel, so they
+    # never go through Python objects.
+    with args.png_file as png_file, \
+            mmap.mmap(png_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+
+        def parse_chunk(offset):
+            # ``peek`` decodes only what's needed to find the field
+            # boundaries, plus the fields we ask for. ``field_span`` tells us
+            # where a field is in the buffer.
+            chunk = PNGChunk.peek(data, offset)
+            if bytes(chunk['type']) != b'deAd':
+                return None
+            data_offset, _data_len = chunk.field_span('data')
+            dead = DataDEAD.peek(data, data_offset, fields=['name'])
+            file_name = bytes(dead['name']).decode()
             if file_name in files_to_extract:
-                print('Extracting {} ....'.format(repr(file_name)))
-                full_name = os.path.join(args.output, file_name)
-                with open(full_name, 'xb') as out_file:
-                    out_file.write(bytes(c['data']['data']))
                 files_to_extract.remove(file_name)
+                return (file_name, dead.field_span('data'))
+            return None
+
+        def write_file(name_and_span):
+            if name_and_span is None:
+                return
+            file_name, (file_offset, file_len) = name_and_span
+            print('Extracting {} ....'.format(repr(file_name)))
+            full_name = os.path.join(args.output, file_name)
+            with open(full_name, 'xb') as out_file:
+                copy_range(png_file, out_file, file_offset, file_len)
+
+        # Chunks are parsed one at a time while previously found files are
+        # being written out.
+        extractor = dp.Pipeline(
+            parse_chunk,
+            dp.Stage(write_file, workers=4))
+        for _written in extractor.run(iter_chunk_offsets(data)):
+            pass
 
     if len(files_to_extract) > 0:
         print('File(s) not found:')
@@ -1 +1,9 @@
 __version__ = '0.1.2'
+
+
+def diff(cls, buf_a, buf_b, offset_a=0, offset_b=0):
+    """Compare two packed ``cls`` objects, see ``dumpy.structdiff.diff``."""
+    # Imported here, so that dumpy.config can still be changed before
+    # dumpy.types gets imported.
+    from .structdiff import diff as structdiff
+    return structdiff(cls, buf_a, buf_b, offset_a, offset_b)
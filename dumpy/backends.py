@@ -0,0 +1,582 @@
+"""
+Accelerated pack/unpack backends, and a harness to check them against the
+reference backend.
+
+Importing this module registers the backends defined here, but
+``dumpy.types.get_backend`` also imports it on demand, so setting
+``dumpy.config.BACKEND`` to one of their names is enough to use them.
+
+"""
+
+
+import random
+import struct
+import contextlib
+from . import config
+from . import types as dt
+
+
+class _FusedLayout:
+    def __init__(self, fmt, plan):
+        self.struct = struct.Struct(fmt)
+        self.plan = plan
+
+
+def _fused_plan(cls, endian):
+    """Returns ``(plan, codes)`` for a fused layout, or ``None`` if ``cls``
+    can't be fused.
+
+    ``endian`` is a one-element list holding the byte order shared by all
+    the primitives, or ``None`` if no primitive was seen yet.
+    """
+    plan = []
+    codes = []
+    for fname in cls.__fields__:
+        finfo = cls.__field_info__[fname]
+        if callable(finfo.count) or isinstance(finfo.tp, dt.VariableType):
+            return None
+        if finfo.count <= 0:
+            continue
+
+        tp = finfo.tp
+        if issubclass(tp, dt.CompositeStructMixin):
+            sub = _fused_plan(tp, endian)
+            if sub is None:
+                return None
+            subplan, subcodes = sub
+            plan.append((fname, finfo, tp, subplan, tp.__fixed_size__))
+            codes.extend(subcodes * finfo.count)
+        elif issubclass(tp, dt.PrimitiveStructMixin):
+            fmt = tp.__struct__.format
+            if isinstance(fmt, bytes):
+                fmt = fmt.decode()
+            if len(fmt) != 2 or fmt[0] == '@':
+                return None
+            if endian[0] is None:
+                endian[0] = fmt[0]
+            elif endian[0] != fmt[0]:
+                return None
+            plan.append((fname, finfo, tp, None, tp.__struct__.size))
+            codes.append('{}{}'.format(finfo.count, fmt[1]))
+        else:
+            return None
+    return (plan, codes)
+
+
+def _fused_layout(cls):
+    try:
+        return cls.__dict__['__fused__']
+    except KeyError:
+        pass
+
+    endian = [None]
+    layout = None
+    if cls.__fixed_size__ is not None:
+        fused = _fused_plan(cls, endian)
+        if fused is not None:
+            plan, codes = fused
+            layout = _FusedLayout((endian[0] or '=') + ''.join(codes), plan)
+    cls.__fused__ = layout
+    return layout
+
+
+class FusedBackend(dt.Backend):
+    """Packs and unpacks a whole fixed-size composite, nested composites
+    included, with a single ``struct`` call.
+
+    Only composites made of primitives sharing one byte order are
+    supported.
+    """
+
+    name = 'fused'
+
+    def supports(self, cls):
+        return _fused_layout(cls) is not None
+
+    def _flatten(self, obj, plan, values):
+        for fname, finfo, tp, subplan, _elem_size in plan:
+            val = obj._get_field(fname, finfo.count, finfo.default)
+            if finfo.count == 1:
+                val = [val]
+            if subplan is None:
+                values.extend(val)
+            else:
+                for v in val:
+                    self._flatten(v, subplan, values)
+
+    def pack(self, obj):
+        layout = _fused_layout(type(obj))
+        values = []
+        self._flatten(obj, layout.plan, values)
+        return layout.struct.pack(*values)
+
+    def pack_into(self, obj, buf, offset):
+        layout = _fused_layout(type(obj))
+        total_size = layout.struct.size
+        if len(buf) - offset < total_size:
+            raise ValueError(
+                'pack_into needs {} bytes of space, but only got {}'.format(
+                    total_size, len(buf[offset:])))
+        values = []
+        self._flatten(obj, layout.plan, values)
+        layout.struct.pack_into(buf, offset, *values)
+
+    def size(self, obj):
+        return _fused_layout(type(obj)).struct.size
+
+    def _fill(self, obj, plan, values, idx, offset, parent):
+        obj.offset = offset
+        dt._set_parent(obj, parent)
+
+        for fname, finfo, tp, subplan, elem_size in plan:
+            count = finfo.count
+            if subplan is None:
+                val_list = [tp.from_value(v) for v in values[idx:idx + count]]
+                idx += count
+            else:
+                val_list = []
+                old_list = obj._safe_get(fname)
+                if count == 1:
+                    old_list = [old_list]
+                elif type(old_list) is not list:
+                    old_list = []
+                for i in range(count):
+                    child = old_list[i] if i < len(old_list) else None
+                    if type(child) is not tp or child._frozen:
+                        child = tp._acquire()
+                    idx = self._fill(
+                        child, subplan, values, idx,
+                        offset + i * elem_size, obj)
+                    val_list.append(child)
+            offset += elem_size * count
+
+            if count > 1:
+                old_list = obj._safe_get(fname)
+                if type(old_list) is list:
+                    old_list[:] = val_list
+                    val_list = old_list
+                type(obj)._validate(val_list, finfo, obj)
+                dict.__setitem__(obj, fname, val_list)
+            else:
+                type(obj)._validate(val_list[0], finfo, obj)
+                if isinstance(finfo.default, dt.BitGroup):
+                    obj._set_bits(finfo.default, val_list[0], True)
+                else:
+                    dict.__setitem__(obj, fname, val_list[0])
+        return idx
+
+    def unpack_into(self, cls, obj, buf, offset, parent):
+        layout = _fused_layout(cls)
+        values = layout.struct.unpack_from(buf, offset)
+        self._fill(obj, layout.plan, values, 0, offset, parent)
+        return (obj, offset + layout.struct.size)
+
+
+dt.register_backend(FusedBackend())
+
+
+def _check_depth(depth):
+    max_depth = config.MAX_DEPTH
+    if max_depth is not None and depth > max_depth:
+        raise ValueError(
+            'Objects nested more than {} levels deep'.format(max_depth))
+
+
+def _charge(budget, count):
+    if budget[0] is not None:
+        budget[0] -= count
+        if budget[0] < 0:
+            raise ValueError(
+                'Objects have more than {} elements'.format(
+                    config.MAX_ELEMENTS))
+
+
+class IterativeBackend(dt.Backend):
+    """Walks nested composites with an explicit stack instead of recursion.
+
+    Each composite level is a generator, which yields a request whenever it
+    needs a sub-object, so objects can be nested as deep as memory allows.
+    ``dumpy.config.MAX_DEPTH`` and ``dumpy.config.MAX_ELEMENTS`` limit the
+    nesting depth and the number of decoded elements, to protect against
+    hostile input.
+    """
+
+    name = 'iterative'
+
+    def _pack_gen(self, obj, sizes):
+        objs, depth = dt._enter(obj)
+        cls = type(obj)
+        for fname in cls.__fields__:
+            finfo = cls.__field_info__[fname]
+            val = obj._get_field(fname, finfo.count, finfo.default)
+
+            if val is None:
+                continue
+
+            if isinstance(val, list) and \
+                    isinstance(finfo.tp, type) and \
+                    issubclass(finfo.tp, dt.PrimitiveStructMixin):
+                if sizes:
+                    yield finfo.tp.__struct__.size * len(val)
+                else:
+                    yield finfo.tp.pack_many(val)
+                continue
+
+            if not isinstance(val, list):
+                val = [val]
+            for v in val:
+                if isinstance(v, dt.CompositeStructMixin):
+                    yield v
+                    continue
+                if not hasattr(v, 'pack'):
+                    if isinstance(finfo.tp, dt.VariableType):
+                        ftype = finfo.tp.get_type(obj)
+                    else:
+                        ftype = finfo.tp
+                    v = ftype.from_value(v)
+                yield v.size if sizes else v.pack()
+        del objs[depth:]
+
+    def _prepare_gen(self, obj, sizes):
+        objs, depth = dt._enter(obj)
+        for val in list(dict.values(obj)):
+            if not isinstance(val, list):
+                val = [val]
+            for v in val:
+                if isinstance(v, dt.CompositeStructMixin) and \
+                        v._packed is None and id(v) not in sizes:
+                    yield v
+
+        # The sub-objects are sized, so defaults reading their sizes don't
+        # recurse
+        obj._resolve_defaults()
+        size = 0
+        for item in self._pack_gen(obj, True):
+            if isinstance(item, dt.CompositeStructMixin):
+                item = item.size
+            size += item
+        sizes[id(obj)] = size
+        del objs[depth:]
+
+    def prepare(self, obj):
+        # Defaults and sizes are evaluated bottom-up, with an explicit stack
+        sizes = dt._object_stack.memo.sizes
+        if id(obj) in sizes:
+            return
+        stack = [self._prepare_gen(obj, sizes)]
+        while stack:
+            for item in stack[-1]:
+                if id(item) in sizes:
+                    # Reachable more than once
+                    continue
+                _check_depth(len(stack) + 1)
+                stack.append(self._prepare_gen(item, sizes))
+                break
+            else:
+                stack.pop()
+
+    def _walk(self, obj, sizes):
+        stack = [self._pack_gen(obj, sizes)]
+        while stack:
+            for item in stack[-1]:
+                if isinstance(item, dt.CompositeStructMixin):
+                    _check_depth(len(stack) + 1)
+                    stack.append(self._pack_gen(item, sizes))
+                    break
+                yield item
+            else:
+                stack.pop()
+
+    def pack(self, obj):
+        return b''.join(self._walk(obj, False))
+
+    def pack_into(self, obj, buf, offset):
+        data = self.pack(obj)
+        if len(buf) - offset < len(data):
+            raise ValueError(
+                'pack_into needs {} bytes of space, but only got {}'.format(
+                    len(data), len(buf[offset:])))
+        buf[offset:offset + len(data)] = data
+
+    def size(self, obj):
+        self.prepare(obj)
+        return dt._object_stack.memo.sizes[id(obj)]
+
+    def _unpack_gen(self, cls, obj, buf, offset, parent, budget):
+        objs, depth = dt._enter(obj)
+        obj.offset = offset
+        dt._set_parent(obj, parent)
+
+        for fname in cls.__fields__:
+            finfo = cls.__field_info__[fname]
+            count = finfo.count
+
+            if callable(count) or count > 1:
+                val_list = obj._safe_get(fname)
+                if type(val_list) is not list:
+                    val_list = []
+
+            if isinstance(finfo.tp, dt.VariableType):
+                ftype = finfo.tp.get_type(obj, offset)
+            else:
+                ftype = finfo.tp
+            composite = issubclass(ftype, dt.CompositeStructMixin)
+
+            if isinstance(count, dt.Terminator):
+                cls._release_all(val_list)
+                val_list.clear()
+                dict.__setitem__(obj, fname, val_list)
+                if not composite:
+                    offset = count.scan(ftype, buf, offset, obj, val_list)
+                    _charge(budget, len(val_list))
+                else:
+                    to_eof = isinstance(count, dt.EOFTerminator)
+                    while not (to_eof and offset >= len(buf)):
+                        _charge(budget, 1)
+                        v, offset = yield (ftype, None, offset, obj)
+                        val_list.append(v)
+                        if count.matches(v):
+                            break
+                cls._validate(val_list, finfo, obj)
+                continue
+
+            if callable(count):
+                real_count = dt._call(count, obj, offset)
+            else:
+                real_count = count
+
+            if isinstance(real_count, bool):
+                cls._release_all(val_list)
+                val_list.clear()
+                dict.__setitem__(obj, fname, val_list)
+                while dt._call(count, obj, offset):
+                    _charge(budget, 1)
+                    if composite:
+                        v, offset = yield (ftype, None, offset, obj)
+                    else:
+                        v, offset = dt._unpack_next(ftype, buf, offset, obj)
+                    val_list.append(v)
+                cls._validate(val_list, finfo, obj)
+
+            elif callable(count) or real_count > 1:
+                # Charged up front, so hostile counts fail before decoding
+                _charge(budget, real_count)
+                if composite:
+                    old_count = len(val_list)
+                    for i in range(real_count):
+                        old = val_list[i] if i < old_count else None
+                        v, offset = yield (ftype, old, offset, obj)
+                        if i < old_count:
+                            val_list[i] = v
+                        else:
+                            val_list.append(v)
+                    cls._release_all(val_list[real_count:])
+                    del val_list[real_count:]
+                elif issubclass(ftype, dt.PrimitiveStructMixin):
+                    cls._release_all(val_list)
+                    val_list[:] = ftype.unpack_many(buf, offset, real_count)
+                    offset += ftype.__struct__.size * real_count
+                else:
+                    cls._release_all(val_list)
+                    val_list.clear()
+                    for _i in range(real_count):
+                        v, offset = dt._unpack_next(ftype, buf, offset, obj)
+                        val_list.append(v)
+
+                cls._validate(val_list, finfo, obj)
+                dict.__setitem__(obj, fname, val_list)
+
+            elif real_count == 1:
+                _charge(budget, 1)
+                old = obj._safe_get(fname)
+                if composite:
+                    v, offset = yield (ftype, old, offset, obj)
+                else:
+                    cls._release_all([old])
+                    v, offset = dt._unpack_next(ftype, buf, offset, obj)
+
+                cls._validate(v, finfo, obj)
+                if isinstance(finfo.default, dt.BitGroup):
+                    obj._set_bits(finfo.default, v, True)
+                else:
+                    dict.__setitem__(obj, fname, v)
+
+        del objs[depth:]
+        return (obj, offset)
+
+    def unpack_into(self, cls, obj, buf, offset, parent):
+        budget = [config.MAX_ELEMENTS]
+        stack = [self._unpack_gen(cls, obj, buf, offset, parent, budget)]
+        result = None
+        while True:
+            try:
+                request = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                if not stack:
+                    return result
+                continue
+
+            ftype, old, offset, parent = request
+            if ftype.__dict__.get('__parse_cache__') is not None:
+                # Cached objects are shared and frozen, get them the usual way
+                result = ftype._unpack_end(buf, offset, parent)
+                continue
+
+            if isinstance(old, dt.CompositeStructMixin) and \
+                    (type(old) is not ftype or old._frozen):
+                old.release()
+                old = None
+            if not isinstance(old, dt.CompositeStructMixin):
+                old = ftype._acquire()
+            _check_depth(len(stack) + 1)
+            stack.append(
+                self._unpack_gen(ftype, old, buf, offset, parent, budget))
+            result = None
+
+
+dt.register_backend(IterativeBackend())
+
+
+@contextlib.contextmanager
+def use_backend(name):
+    """Temporarily select a backend globally."""
+    dt.get_backend(name)
+    old_name = config.BACKEND
+    config.BACKEND = name
+    try:
+        yield
+    finally:
+        config.BACKEND = old_name
+
+
+def _random_primitive(tp, rng):
+    if issubclass(tp, float):
+        # Exactly representable in single precision
+        return tp(rng.randint(-1 << 20, 1 << 20) / 8)
+    data = bytes(rng.getrandbits(8) for _i in range(tp.__struct__.size))
+    return tp.unpack(data)
+
+
+def _random_element(tp, rng, max_count, depth, generators):
+    if issubclass(tp, dt.CompositeStructMixin):
+        return random_instance(tp, rng, max_count, depth + 1, generators)
+    return _random_primitive(tp, rng)
+
+
+def random_instance(cls, rng=random, max_count=4, depth=0, generators=None):
+    """Build a random, packable instance of a composite class.
+
+    Fields with defaults are left unset, and fields counted by another
+    field through ``dumpy.types.depends`` have that field set to match.
+    Fields with boolean count callables can't be generated.
+
+    ``generators`` maps ``(class, field name)`` pairs to callables taking
+    the object being built and ``rng``, and returning a value for fields
+    that can't be generated otherwise, such as fields with a contextual
+    count or values a validator checks.
+    """
+    if depth > 16:
+        raise RecursionError('Schema {} is too deep'.format(cls.__name__))
+
+    obj = cls()
+    for fname in cls.__fields__:
+        finfo = cls.__field_info__[fname]
+
+        gen = generators.get((cls, fname)) if generators else None
+        if gen is not None:
+            obj[fname] = gen(obj, rng)
+            continue
+
+        if isinstance(finfo.default, dt.BitGroup):
+            for m in finfo.default.members:
+                obj[m.name] = rng.randint(0, m.tp.mask)
+            continue
+        if finfo.default is not dt.NoDefault and finfo.count == 1:
+            continue
+
+        if isinstance(finfo.tp, dt.VariableType):
+            ftype = finfo.tp.get_type(obj)
+        else:
+            ftype = finfo.tp
+
+        def element():
+            return _random_element(ftype, rng, max_count, depth, generators)
+
+        count = finfo.count
+        if isinstance(count, dt.FieldTerminator):
+            val = [element() for _i in range(rng.randint(0, max_count))]
+            for v in val:
+                while count.matches(v):
+                    v[count.name] = element()[count.name]
+            last = element()
+            last[count.name] = count.value
+            val.append(last)
+        elif isinstance(count, dt.ByteTerminator):
+            val = [rng.choice([b for b in range(1, 256) if b != count.value])
+                   for _i in range(rng.randint(0, max_count))]
+            val.append(count.value)
+        elif isinstance(count, dt.EOFTerminator):
+            val = [element() for _i in range(rng.randint(0, max_count))]
+        elif callable(count):
+            deps = getattr(count, 'depends', None)
+            if deps is None or len(deps) != 1:
+                raise TypeError(
+                    'Cannot generate field {} of {}'.format(
+                        repr(fname), cls.__name__))
+            val = [element() for _i in range(rng.randint(0, max_count))]
+            if cls.__field_info__[deps[0]].default is dt.NoDefault:
+                obj[deps[0]] = len(val)
+        elif count == 1:
+            val = element()
+        elif count > 1:
+            val = [element() for _i in range(count)]
+        else:
+            continue
+
+        obj[fname] = val
+    return obj
+
+
+def check_equivalence(cls, obj, backends=None):
+    """Pack and unpack ``obj`` with every backend, and check that they all
+    agree with the reference backend. Returns the packed bytes.
+    """
+    if backends is None:
+        backends = list(dt._BACKENDS)
+
+    with use_backend('reference'):
+        expected = obj.pack()
+        expected_obj = cls.unpack(expected)
+
+    for name in backends:
+        with use_backend(name):
+            packed = obj.pack()
+            if packed != expected:
+                raise AssertionError(
+                    'Backend {} packed {} as {}, expected {}'.format(
+                        repr(name), cls.__name__,
+                        repr(packed), repr(expected)))
+
+            if obj.size != len(expected):
+                raise AssertionError(
+                    'Backend {} reported size {} for {}, expected {}'.format(
+                        repr(name), obj.size, cls.__name__, len(expected)))
+
+            buf = bytearray(len(expected) + 2)
+            obj.pack_into(buf, 1)
+            if bytes(buf[1:-1]) != expected:
+                raise AssertionError(
+                    'Backend {} packed {} into {}, expected {}'.format(
+                        repr(name), cls.__name__,
+                        repr(bytes(buf[1:-1])), repr(expected)))
+
+            unpacked = cls.unpack_from(buf, 1)
+            if unpacked != expected_obj or unpacked.pack() != expected:
+                raise AssertionError(
+                    'Backend {} unpacked {} as {}, expected {}'.format(
+                        repr(name), cls.__name__,
+                        repr(unpacked), repr(expected_obj)))
+
+    return expected
@@ -0,0 +1,150 @@
+"""
+Packing many messages into one buffer, and splitting them back out.
+
+An ``Encoder`` packs objects back to back into a single reusable
+``bytearray``, with ``pack_into``, so sending a batch of small messages
+doesn't allocate and copy a ``bytes`` object for each one. A ``Decoder``
+splits a received buffer into messages with ``unpack_from``, in one pass.
+
+Messages can be framed, i.e. preceded by a header telling their size. A
+framing is any object with a ``header_size`` attribute and these methods:
+
+    pack_header(buf, offset, length)
+        Write the header of a ``length`` bytes long message at ``offset``.
+
+    unpack_header(buf, offset)
+        Return the message length stored in the header at ``offset``.
+
+"""
+
+
+from . import types as dt
+
+
+class LengthPrefix:
+    """Frames messages with their size, stored as a ``length_type`` value."""
+
+    def __init__(self, length_type=dt.UInt32):
+        self.length_type = length_type
+        self.header_size = length_type.__struct__.size
+
+    def pack_header(self, buf, offset, length):
+        self.length_type.__struct__.pack_into(buf, offset, length)
+
+    def unpack_header(self, buf, offset):
+        (length,) = self.length_type.__struct__.unpack_from(buf, offset)
+        return length
+
+
+class Encoder:
+    """Packs objects into a growing buffer.
+
+    The buffer is kept by ``reset``, so an encoder can be reused for many
+    batches without allocating again. ``offsets`` holds the offset of
+    every message (including its header) in the buffer.
+    """
+
+    def __init__(self, framing=None, initial_size=4096):
+        self.framing = framing
+        self.offset = 0
+        self.offsets = []
+        self._buf = bytearray(initial_size)
+
+    def _reserve(self, length):
+        needed = self.offset + length
+        if needed > len(self._buf):
+            new_size = max(needed, len(self._buf) * 2)
+            self._buf.extend(bytes(new_size - len(self._buf)))
+
+    def add(self, obj):
+        """Pack ``obj`` after the previous messages. Returns its offset."""
+        # Sizing and packing share the computed defaults
+        state = dt._enter_pack(obj)
+        try:
+            size = obj.size
+            header_size = 0 if self.framing is None else \
+                self.framing.header_size
+            self._reserve(header_size + size)
+
+            start = self.offset
+            if self.framing is not None:
+                self.framing.pack_header(self._buf, start, size)
+            obj.pack_into(self._buf, start + header_size)
+        finally:
+            dt._leave_pack(state)
+
+        self.offset = start + header_size + size
+        self.offsets.append(start)
+        return start
+
+    def extend(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    def getbuffer(self):
+        """Returns a ``memoryview`` of the packed messages.
+
+        The view must be released before adding more messages, since the
+        buffer can't be resized while it's exported.
+        """
+        return memoryview(self._buf)[:self.offset]
+
+    def getvalue(self):
+        return bytes(self._buf[:self.offset])
+
+    def reset(self):
+        self.offset = 0
+        self.offsets.clear()
+
+    def __len__(self):
+        return self.offset
+
+
+class Decoder:
+    """Splits a buffer into ``cls`` objects."""
+
+    def __init__(self, cls, framing=None):
+        self.cls = cls
+        self.framing = framing
+
+    def iter_decode(self, buf, offset=0):
+        """Yields ``(obj, end)`` for each complete message in ``buf``.
+
+        With a framing, decoding stops quietly at an incomplete message,
+        whose offset is the ``end`` of the last one yielded. Without a
+        framing, messages are unpacked until the end of the buffer.
+        """
+        end = len(buf)
+        cls = self.cls
+        framing = self.framing
+
+        while offset < end:
+            if framing is None:
+                obj, offset = cls._unpack_end(buf, offset, None)
+                yield (obj, offset)
+                continue
+
+            body = offset + framing.header_size
+            if body > end:
+                return
+            length = framing.unpack_header(buf, offset)
+            if body + length > end:
+                return
+            obj, obj_end = cls._unpack_end(buf, body, None)
+            if obj_end - body != length:
+                raise ValueError(
+                    'Framed message at offset {} has {} bytes, but its '
+                    'content has {}'.format(offset, length, obj_end - body))
+            offset = body + length
+            yield (obj, offset)
+
+    def decode(self, buf, offset=0):
+        """Returns the list of messages in ``buf``, and where they end.
+
+        Bytes after the end offset belong to an incomplete message, which
+        should be decoded again when the rest of it arrives.
+        """
+        messages = []
+        for obj, offset in self.iter_decode(buf, offset):
+            messages.append(obj)
+        return (messages, offset)
@@ -1 +1,15 @@
 ENDIAN = '>'
+FLYWEIGHT_RANGE = (-128, 256)
+BACKEND = 'reference'
+# Resource limits enforced by the 'iterative' backend, None means no limit
+MAX_DEPTH = None
+MAX_ELEMENTS = None
+# Give nested composites a ``parent`` weakref to the enclosing object.
+# Callables marked with ``dumpy.types.contextual`` don't need them.
+PARENT_REFS = True
+# How validators run when unpacking: 'eager' runs each one as soon as its
+# field is decoded, 'deferred' runs them all at the end and reports every
+# failure in a single ValidationError, and 'off' doesn't run them at all.
+# Unless it's 'eager', assigning fields doesn't check sequence types and
+# counts either, counts are checked again when packing.
+VALIDATION = 'eager'
@@ -0,0 +1,163 @@
+"""
+ctypes layouts for fixed-size composite classes.
+
+The generated ``ctypes`` structures have exactly the packed layout of the
+composite class, so they can map packed data in place with ``from_buffer``
+and be handed to C code as they are. Bit groups appear as their storage
+word.
+
+"""
+
+
+import ctypes
+from . import types as dt
+
+
+_CTYPES = {
+    'b': ctypes.c_int8,
+    'B': ctypes.c_uint8,
+    'h': ctypes.c_int16,
+    'H': ctypes.c_uint16,
+    'i': ctypes.c_int32,
+    'I': ctypes.c_uint32,
+    'l': ctypes.c_int32,
+    'L': ctypes.c_uint32,
+    'q': ctypes.c_int64,
+    'Q': ctypes.c_uint64,
+    'f': ctypes.c_float,
+    'd': ctypes.c_double,
+    '?': ctypes.c_bool,
+}
+
+_STRUCTURES = {
+    '<': ctypes.LittleEndianStructure,
+    '>': ctypes.BigEndianStructure,
+    '!': ctypes.BigEndianStructure,
+    '=': ctypes.Structure,
+}
+
+
+def _struct_format(tp):
+    fmt = tp.__struct__.format
+    if isinstance(fmt, bytes):
+        fmt = fmt.decode()
+    return fmt[0], fmt[1:]
+
+
+def _check_base(base, bases, name):
+    if bases[0] is None:
+        bases[0] = base
+    elif bases[0] is not base:
+        # Nested structures must have the same byte order as their parents
+        raise TypeError('{} does not use the same byte order'.format(name))
+
+
+def _primitive_ctype(tp, bases):
+    endian, fmt = _struct_format(tp)
+    if endian == '@':
+        raise TypeError(
+            'Type {} uses native alignment'.format(tp.__name__))
+    _check_base(_STRUCTURES[endian], bases, tp.__name__)
+
+    if fmt not in _CTYPES:
+        raise TypeError(
+            'No ctypes equivalent for format {} of {}'.format(
+                repr(fmt), tp.__name__))
+    return _CTYPES[fmt]
+
+
+def as_ctypes(cls):
+    """Returns the ctypes structure class equivalent to ``cls``.
+
+    Raises ``TypeError`` if ``cls`` doesn't have a fixed layout, or mixes
+    byte orders.
+    """
+    try:
+        return cls.__dict__['__ctypes__']
+    except KeyError:
+        pass
+
+    if cls.__fixed_size__ is None:
+        raise TypeError(
+            '{} does not have a fixed layout'.format(cls.__name__))
+
+    fields = []
+    bases = [None]
+    for fname in cls.__fields__:
+        finfo = cls.__field_info__[fname]
+        if finfo.count <= 0:
+            continue
+        if issubclass(finfo.tp, dt.CompositeStructMixin):
+            ctype = as_ctypes(finfo.tp)
+            _check_base(ctype.__bases__[0], bases, finfo.tp.__name__)
+        else:
+            ctype = _primitive_ctype(finfo.tp, bases)
+        if finfo.count > 1:
+            ctype = ctype * finfo.count
+        fields.append((fname, ctype))
+
+    ctype = type(cls.__name__, (bases[0] or ctypes.Structure,),
+                 {'_pack_': 1, '_fields_': fields})
+    if ctypes.sizeof(ctype) != cls.__fixed_size__:
+        raise TypeError(
+            'Cannot reproduce the layout of {}'.format(cls.__name__))
+    cls.__ctypes__ = ctype
+    return ctype
+
+
+def _to_c(value):
+    if isinstance(value, dt.CompositeStructMixin):
+        return to_ctypes(value)
+    return value
+
+
+def _fill(cobj, obj):
+    cls = type(obj)
+    for fname, ctype in type(cobj)._fields_:
+        finfo = cls.__field_info__[fname]
+        val = obj._get_field(fname, finfo.count, finfo.default)
+        if finfo.count > 1:
+            carray = getattr(cobj, fname)
+            for i, v in enumerate(val):
+                carray[i] = _to_c(v)
+        else:
+            setattr(cobj, fname, _to_c(val))
+
+
+def to_ctypes(obj):
+    """Convert a composite object to its ctypes structure."""
+    cobj = as_ctypes(type(obj))()
+    _fill(cobj, obj)
+    return cobj
+
+
+def _from_c(cvalue, tp):
+    if issubclass(tp, dt.CompositeStructMixin):
+        return from_ctypes(tp, cvalue)
+    return tp.from_value(cvalue)
+
+
+def from_ctypes(cls, cobj):
+    """Convert a ctypes structure back to a composite object."""
+    obj = cls()
+    for fname, ctype in type(cobj)._fields_:
+        finfo = cls.__field_info__[fname]
+        cvalue = getattr(cobj, fname)
+        if finfo.count > 1:
+            obj[fname] = [_from_c(v, finfo.tp) for v in cvalue]
+        else:
+            obj[fname] = _from_c(cvalue, finfo.tp)
+    return obj
+
+
+def view(cls, buf, offset=0):
+    """Map the ctypes structure of ``cls`` onto ``buf`` at ``offset``.
+
+    Writable buffers are shared with the returned structure, read-only
+    ones are copied.
+    """
+    ctype = as_ctypes(cls)
+    try:
+        return ctype.from_buffer(buf, offset)
+    except TypeError:
+        return ctype.from_buffer_copy(buf, offset)
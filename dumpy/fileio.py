@@ -0,0 +1,199 @@
+"""
+Helpers for working with packed data stored in files.
+
+"""
+
+
+import os
+import mmap
+import errno
+from . import types as dt
+
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Errors meaning a zero-copy system call can't handle this pair of files
+_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                       errno.EOPNOTSUPP, errno.EBADF)
+
+
+def _fileno(f):
+    if isinstance(f, int):
+        return f
+    return f.fileno()
+
+
+def _copy_file_range(src_fd, dst_fd, offset, length):
+    copied = 0
+    while copied < length:
+        n = os.copy_file_range(
+            src_fd, dst_fd, length - copied, offset_src=offset + copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def _sendfile(src_fd, dst_fd, offset, length):
+    copied = 0
+    while copied < length:
+        n = os.sendfile(dst_fd, src_fd, offset + copied, length - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def _read_write(src_fd, dst_fd, offset, length):
+    copied = 0
+    while copied < length:
+        data = os.pread(src_fd, min(_COPY_CHUNK_SIZE, length - copied),
+                        offset + copied)
+        if not data:
+            break
+        view = memoryview(data)
+        while view:
+            n = os.write(dst_fd, view)
+            view = view[n:]
+        copied += len(data)
+    return copied
+
+
+def copy_range(src, dst, offset, length):
+    """Copy ``length`` bytes at ``offset`` in ``src`` to ``dst``.
+
+    ``src`` and ``dst`` are file objects or file descriptors. The bytes are
+    written at the current position of ``dst``, so flush any buffered file
+    object before calling this. The data are copied inside the kernel with
+    ``os.copy_file_range`` or ``os.sendfile`` when possible, falling back
+    to plain reads and writes.
+    """
+    src_fd = _fileno(src)
+    dst_fd = _fileno(dst)
+
+    copied = 0
+    for copy_func in (_copy_file_range, _sendfile, _read_write):
+        try:
+            copied += copy_func(
+                src_fd, dst_fd, offset + copied, length - copied)
+            break
+        except AttributeError:
+            # Not supported on this platform
+            continue
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED_ERRNOS or \
+                    copy_func is _read_write:
+                raise
+
+    if copied < length:
+        raise ValueError(
+            'Expected {} bytes at offset {}, but only got {}'.format(
+                length, offset, copied))
+    return copied
+
+
+def read_field(cls, f, fname, base=0):
+    """Read a single field of a ``cls`` object stored at ``base`` in ``f``.
+
+    ``f`` is a file object or a file descriptor. The field must have a
+    static offset and a fixed size, so that it can be fetched with a single
+    ``os.pread`` without decoding anything before it.
+    """
+    finfo = cls.__field_info__[fname]
+    offset = base + cls.offset_of(fname)
+
+    bit_info = None
+    if isinstance(finfo.tp, dt.BitInfo):
+        bit_info = finfo.tp
+        finfo = cls.__field_info__[bit_info.group.name]
+
+    if callable(finfo.count) or isinstance(finfo.tp, dt.VariableType):
+        raise ValueError(
+            'Field {} does not have a fixed size'.format(repr(fname)))
+    if finfo.count <= 0:
+        raise ValueError('Field {} cannot be read'.format(repr(fname)))
+    elem_size = dt._fixed_size_of(finfo.tp)
+    if elem_size is None:
+        raise ValueError(
+            'Field {} does not have a fixed size'.format(repr(fname)))
+
+    length = elem_size * finfo.count
+    data = os.pread(_fileno(f), length, offset)
+    if len(data) < length:
+        raise ValueError(
+            'Expected {} bytes at offset {}, but only got {}'.format(
+                length, offset, len(data)))
+
+    if bit_info is not None:
+        word = finfo.tp.unpack(data)
+        return (word >> bit_info.shift) & bit_info.mask
+    if finfo.count == 1:
+        return finfo.tp.unpack_from(data)
+    if issubclass(finfo.tp, dt.PrimitiveStructMixin):
+        return finfo.tp.unpack_many(data, 0, finfo.count)
+    return [finfo.tp.unpack_from(data, i * elem_size)
+            for i in range(finfo.count)]
+
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        n = os.pwrite(fd, view, offset)
+        view = view[n:]
+        offset += n
+    return offset
+
+
+def _pwritev_all(fd, buffers, offset):
+    pwritev = getattr(os, 'pwritev', None)
+    views = [memoryview(b).cast('B') for b in buffers]
+    # Keep clear of the IOV_MAX limit
+    step = 512
+    for i in range(0, len(views), step):
+        chunk = views[i:i + step]
+        if pwritev is None:
+            for v in chunk:
+                offset = _pwrite_all(fd, v, offset)
+            continue
+        while chunk:
+            n = pwritev(fd, chunk, offset)
+            offset += n
+            while chunk and n >= len(chunk[0]):
+                n -= len(chunk[0])
+                chunk.pop(0)
+            if chunk and n:
+                chunk[0] = chunk[0][n:]
+    return offset
+
+
+def append_records(cls, f, fname, records, base=0):
+    """Append ``records`` to a terminated list field, in place.
+
+    ``cls`` is the type of the object stored at ``base`` in ``f``, and
+    ``fname`` a field of it with a terminator count. ``f`` must be opened
+    for both reading and writing. ``records`` are objects, packed bytes or
+    buffer lists from ``pack_iov``. They are written over the terminating
+    element, which is then written back after them, together with
+    everything that followed it in the file. Only the bytes after the
+    terminator are read back, so the cost doesn't depend on the size of the
+    existing list.
+
+    Returns the new offset of the terminating element.
+    """
+    if not isinstance(f, int):
+        f.flush()
+    fd = _fileno(f)
+
+    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as buf:
+        offset = cls.terminator_offset(fname, buf, base)
+        tail = buf[offset:]
+
+    for rec in records:
+        if isinstance(rec, list):
+            offset = _pwritev_all(fd, rec, offset)
+            continue
+        if not isinstance(rec, (bytes, bytearray, memoryview)):
+            rec = rec.pack()
+        offset = _pwrite_all(fd, rec, offset)
+    _pwrite_all(fd, tail, offset)
+    return offset
@@ -0,0 +1,209 @@
+"""
+Memory accounting for unpacked object trees.
+
+``profile_unpack`` unpacks a buffer with ``tracemalloc`` running, and then
+walks the resulting tree to tell how the memory is spread among the
+composite classes and their fields:
+
+    python -m dumpy.memprofile demo.png_packer:PNGFile some.png
+
+The schema module is imported before ``dumpy.types``, so it can still set
+``dumpy.config.ENDIAN``.
+
+"""
+
+
+import sys
+import argparse
+import importlib
+import tracemalloc
+import collections
+
+
+class MemoryReport:
+    """Memory used by an unpacked object tree.
+
+    ``allocated`` and ``peak`` are measured by ``tracemalloc``, and
+    ``pack_allocated`` is what packing the object again allocated at its
+    peak, if it was measured. ``classes`` maps composite class names to
+    ``[count, bytes]``, where the bytes are held by the objects themselves
+    (the ``dict``, instance attributes and the parent weakref). ``fields``
+    maps ``(class name, field name)`` to the bytes held by the field values,
+    including any sub-objects. Shared values, like flyweights, are not
+    counted.
+    """
+
+    def __init__(self, input_size):
+        self.input_size = input_size
+        self.allocated = 0
+        self.peak = 0
+        self.pack_allocated = None
+        self.classes = collections.defaultdict(lambda: [0, 0])
+        self.fields = collections.Counter()
+
+    @property
+    def per_input_byte(self):
+        if self.input_size <= 0:
+            return 0.0
+        return self.allocated / self.input_size
+
+    def format(self, limit=20):
+        lines = [
+            'Input:      {:12} bytes'.format(self.input_size),
+            'Allocated:  {:12} bytes ({:.1f} per input byte)'.format(
+                self.allocated, self.per_input_byte),
+            'Peak:       {:12} bytes'.format(self.peak),
+        ]
+        if self.pack_allocated is not None:
+            lines.append('Pack peak:  {:12} bytes'.format(self.pack_allocated))
+
+        lines.append('')
+        lines.append('{:>10} {:>12}  {}'.format('objects', 'bytes', 'class'))
+        classes = sorted(self.classes.items(), key=lambda i: -i[1][1])
+        for name, (count, nbytes) in classes[:limit]:
+            lines.append('{:10} {:12}  {}'.format(count, nbytes, name))
+
+        lines.append('')
+        lines.append('{:>12} {:>8}  {}'.format('bytes', 'input', 'field'))
+        for (cname, fname), nbytes in self.fields.most_common(limit):
+            lines.append('{:12} {:8.1f}  {}.{}'.format(
+                nbytes, nbytes / max(self.input_size, 1), cname, fname))
+        return '\n'.join(lines)
+
+
+def _is_shared(dt, value):
+    if isinstance(value, dt.PrimitiveStructMixin):
+        idx = value - value.__flyweight_base__
+        table = value.__flyweights__
+        return 0 <= idx < len(table) and table[idx] is value
+    return False
+
+
+def _value_size(dt, value, report, seen):
+    if id(value) in seen or _is_shared(dt, value):
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, dt.CompositeStructMixin):
+        return _account(dt, value, report, seen)
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(
+            _value_size(dt, v, report, seen) for v in value)
+    if isinstance(value, dt.Compressed):
+        return sys.getsizeof(value) + sum(
+            sys.getsizeof(getattr(value, a)) for a in ('_raw', '_data')
+            if getattr(value, a) is not None)
+    return sys.getsizeof(value)
+
+
+def _account(dt, obj, report, seen):
+    cls = type(obj)
+    own = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs:
+        own += sys.getsizeof(attrs)
+        if obj.parent is not None:
+            own += sys.getsizeof(obj.parent)
+        if obj._spans:
+            own += sys.getsizeof(obj._spans)
+
+    entry = report.classes[cls.__name__]
+    entry[0] += 1
+    entry[1] += own
+
+    total = own
+    for fname, value in dict.items(obj):
+        nbytes = _value_size(dt, value, report, seen)
+        report.fields[(cls.__name__, fname)] += nbytes
+        total += nbytes
+    return total
+
+
+def account(obj, report=None):
+    """Add the memory held by ``obj`` and its sub-objects to ``report``."""
+    from . import types as dt
+
+    if report is None:
+        report = MemoryReport(0)
+    _account(dt, obj, report, set())
+    return report
+
+
+def _reset_peak():
+    # Not available before Python 3.9, the peak is then the highest since
+    # tracing started.
+    reset_peak = getattr(tracemalloc, 'reset_peak', None)
+    if reset_peak is not None:
+        reset_peak()
+
+
+def profile_unpack(cls, buf, offset=0, pack=False):
+    """Unpack a ``cls`` object from ``buf`` and report its memory usage.
+
+    Returns the object and a ``MemoryReport``. With ``pack``, packing the
+    object again is measured as well.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        _reset_peak()
+        before, _peak = tracemalloc.get_traced_memory()
+        obj = cls.unpack_from(buf, offset)
+        after, peak = tracemalloc.get_traced_memory()
+
+        report = MemoryReport(obj.size)
+        report.allocated = after - before
+        report.peak = peak - before
+
+        if pack:
+            _reset_peak()
+            before, _peak = tracemalloc.get_traced_memory()
+            obj.pack()
+            _current, peak = tracemalloc.get_traced_memory()
+            report.pack_allocated = peak - before
+    finally:
+        if started:
+            tracemalloc.stop()
+
+    account(obj, report)
+    return (obj, report)
+
+
+def load_schema(spec):
+    """Import a class given as ``module:ClassName``."""
+    mod_name, sep, cls_name = spec.partition(':')
+    if not sep:
+        raise ValueError(
+            'Schema should be given as module:ClassName, got {}'.format(
+                repr(spec)))
+    obj = importlib.import_module(mod_name)
+    for name in cls_name.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m dumpy.memprofile',
+        description='Report the memory used by an unpacked file')
+    parser.add_argument('schema', metavar='SCHEMA',
+                        help='The class to unpack, as module:ClassName')
+    parser.add_argument('file', metavar='FILE', help='The file to unpack')
+    parser.add_argument('--offset', type=int, default=0,
+                        help='Where the object starts in the file')
+    parser.add_argument('--pack', action='store_true',
+                        help='Also measure packing the object again')
+    parser.add_argument('--limit', type=int, default=20,
+                        help='How many classes and fields to list')
+    args = parser.parse_args(argv)
+
+    cls = load_schema(args.schema)
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    _obj, report = profile_unpack(cls, data, args.offset, args.pack)
+    print(report.format(args.limit))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Bounded multi-stage pipelines.
+
+Each stage runs its callable on a thread pool, and stages are connected by
+bounded queues of futures, so I/O in one stage overlaps with work in the
+others while the number of items in flight stays limited by the queue
+depth. Results come out in input order.
+
+"""
+
+
+import queue
+import threading
+from concurrent import futures
+
+
+_END = object()
+
+# How often blocked stage threads check whether the pipeline was closed
+_POLL_INTERVAL = 0.1
+
+
+class _Stopped(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, func, workers=1):
+        self.func = func
+        self.workers = workers
+
+
+class Pipeline:
+    """A chain of stages, each one fed with the results of the previous.
+
+    Stages can be ``Stage`` instances or plain callables, which run on a
+    single worker. A stage with a single worker processes items strictly
+    in order, which is what output stages usually need.
+    """
+
+    def __init__(self, *stages, depth=4):
+        self.stages = [s if isinstance(s, Stage) else Stage(s)
+                       for s in stages]
+        self.depth = depth
+
+    def run(self, items):
+        """Feed ``items`` through all the stages, yielding the results.
+
+        An exception raised by any stage is re-raised here. Closing the
+        returned generator early stops all the stages.
+        """
+        stop = threading.Event()
+        executors = []
+        threads = []
+
+        in_q = None
+        for stage in self.stages:
+            executor = futures.ThreadPoolExecutor(stage.workers)
+            out_q = queue.Queue(self.depth)
+            if in_q is None:
+                source = iter(items)
+            else:
+                source = _drain(in_q, stop)
+            t = threading.Thread(
+                target=_feed,
+                args=(stage.func, executor, source, out_q, stop),
+                daemon=True)
+            executors.append(executor)
+            threads.append(t)
+            in_q = out_q
+
+        for t in threads:
+            t.start()
+
+        try:
+            for fut in _drain(in_q, stop):
+                yield fut.result()
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
+            for executor in executors:
+                executor.shutdown(wait=True)
+
+
+def run(items, *stages, depth=4):
+    return Pipeline(*stages, depth=depth).run(items)
+
+
+def _put(q, item, stop):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            q.put(item, timeout=_POLL_INTERVAL)
+            return
+        except queue.Full:
+            pass
+
+
+def _drain(q, stop):
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            item = q.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        yield item
+
+
+def _failed(exc):
+    fut = futures.Future()
+    fut.set_exception(exc)
+    return fut
+
+
+def _feed(func, executor, source, out_q, stop):
+    try:
+        try:
+            for item in source:
+                if isinstance(item, futures.Future):
+                    item = item.result()
+                _put(out_q, executor.submit(func, item), stop)
+        except _Stopped:
+            return
+        except BaseException as exc:
+            _put(out_q, _failed(exc), stop)
+        _put(out_q, _END, stop)
+    except _Stopped:
+        pass
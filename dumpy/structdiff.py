@@ -0,0 +1,269 @@
+"""
+Structural diff between two packed objects.
+
+The two buffers are walked in lockstep. Only the fields needed to find
+the field boundaries are decoded, and identical byte spans are skipped
+by comparing their bytes directly. Only fields whose bytes differ are decoded
+and, for composite fields, descended into.
+
+"""
+
+
+import collections
+from . import types as dt
+
+
+Change = collections.namedtuple('Change', ['path', 'old', 'new'])
+Change.__doc__ = """A field that differs between the two buffers.
+
+``path`` is a tuple of field names and list indexes. Runs of differing
+elements in lists of primitives end with a ``slice``, and their values are
+lists. ``old`` or ``new`` is ``None`` for list elements only found in one
+of the buffers.
+"""
+
+
+# Comparing memoryview objects goes element by element, comparing bytes
+# objects is a memcmp, so spans are compared as bytes, a chunk at a time.
+_CHUNK_SIZE = 64 * 1024
+
+
+# Differing chunks are split in halves down to this size, before their
+# elements are compared one by one
+_BLOCK_SIZE = 64
+
+
+def _same(buf_a, offset_a, buf_b, offset_b, length):
+    view_a = memoryview(buf_a)
+    view_b = memoryview(buf_b)
+    for i in range(0, length, _CHUNK_SIZE):
+        n = min(_CHUNK_SIZE, length - i)
+        if view_a[offset_a + i:offset_a + i + n].tobytes() != \
+                view_b[offset_b + i:offset_b + i + n].tobytes():
+            return False
+    return True
+
+
+def _differing(view_a, view_b, start, stop, elem_size, found):
+    """Appends the indexes of the differing elements between ``start`` and
+    ``stop`` to ``found``, bisecting the range to skip equal halves."""
+    begin = start * elem_size
+    end = stop * elem_size
+    if view_a[begin:end].tobytes() == view_b[begin:end].tobytes():
+        return
+    if end - begin <= _BLOCK_SIZE or stop - start == 1:
+        for i in range(start, stop):
+            off = i * elem_size
+            if view_a[off:off + elem_size] != view_b[off:off + elem_size]:
+                found.append(i)
+        return
+    middle = (start + stop) // 2
+    _differing(view_a, view_b, start, middle, elem_size, found)
+    _differing(view_a, view_b, middle, stop, elem_size, found)
+
+
+def _differing_runs(buf_a, offset_a, buf_b, offset_b, count, elem_size):
+    """Returns the ``(start, stop)`` index ranges of the differing elements
+    among the first ``count`` ones."""
+    view_a = memoryview(buf_a)[offset_a:offset_a + count * elem_size]
+    view_b = memoryview(buf_b)[offset_b:offset_b + count * elem_size]
+    per_chunk = max(_CHUNK_SIZE // elem_size, 1)
+
+    runs = []
+    for start in range(0, count, per_chunk):
+        found = []
+        _differing(view_a, view_b, start, min(start + per_chunk, count),
+                   elem_size, found)
+        for i in found:
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+    return runs
+
+
+class _Side:
+    """One of the two objects being compared.
+
+    ``stack`` holds the enclosing objects, which count, default and type
+    callables may look up through their ``ParseContext``.
+    """
+
+    def __init__(self, cls, buf, offset, stack):
+        self.buf = buf
+        parent = stack[-1] if stack else None
+        self.obj, self.end = self._run(
+            stack, cls._skip_from, buf, offset, parent, frozenset(), True)
+        self.stack = stack + [self.obj]
+
+    @staticmethod
+    def _run(stack, func, *args):
+        saved = dt._object_stack.objs
+        dt._object_stack.objs = list(stack)
+        try:
+            return func(*args)
+        finally:
+            dt._object_stack.objs = saved
+
+    def run(self, func, *args):
+        return self._run(self.stack, func, *args)
+
+    def span(self, fname):
+        return self.obj._spans[fname]
+
+    def field_type(self, finfo, offset):
+        if isinstance(finfo.tp, dt.VariableType):
+            return self.run(finfo.tp.get_type, self.obj, offset)
+        return finfo.tp
+
+    def elements(self, ftype, offset, length):
+        """Returns the ``(offset, length)`` of each element in a span."""
+        end = offset + length
+        elem_size = dt._fixed_size_of(ftype)
+        elems = []
+        while offset < end:
+            if elem_size is not None:
+                elem_end = offset + elem_size
+            else:
+                _v, elem_end = self.run(
+                    ftype._skip_from, self.buf, offset, self.obj)
+            elems.append((offset, elem_end - offset))
+            offset = elem_end
+        return elems
+
+    def decode(self, ftype, offset):
+        return self.run(ftype.unpack_from, self.buf, offset, self.obj)
+
+    def decode_field(self, ftype, finfo, offset, length):
+        if issubclass(ftype, dt.PrimitiveStructMixin):
+            if finfo.count == 1:
+                return ftype.unpack_from(self.buf, offset)
+            return ftype.unpack_many(
+                self.buf, offset, length // ftype.__struct__.size)
+
+        if finfo.count == 1:
+            return self.decode(ftype, offset)
+        return [self.decode(ftype, off)
+                for off, _len in self.elements(ftype, offset, length)]
+
+
+def _same_span(a, span_a, b, span_b):
+    return span_a[1] == span_b[1] and \
+        _same(a.buf, span_a[0], b.buf, span_b[0], span_a[1])
+
+
+def _diff_bits(finfo, a, b, path, changes):
+    group = finfo.default
+    word_a = finfo.tp.unpack_from(a.buf, a.span(group.name)[0])
+    word_b = finfo.tp.unpack_from(b.buf, b.span(group.name)[0])
+    for m in group.members:
+        old = (word_a >> m.tp.shift) & m.tp.mask
+        new = (word_b >> m.tp.shift) & m.tp.mask
+        if old != new:
+            changes.append(Change(path + (m.name,), old, new))
+
+
+def _diff_values(ftype, a, b, span_a, span_b, path, changes):
+    """Compare lists of primitives, decoding only the differing elements."""
+    elem_size = ftype.__struct__.size
+    count_a = span_a[1] // elem_size
+    count_b = span_b[1] // elem_size
+
+    def values(side, span, start, stop):
+        vals = ftype.unpack_many(
+            side.buf, span[0] + start * elem_size, stop - start)
+        return vals[0] if stop - start == 1 else vals
+
+    def change(start, stop, old, new):
+        key = start if stop - start == 1 else slice(start, stop)
+        changes.append(Change(path + (key,), old, new))
+
+    common = min(count_a, count_b)
+    for start, stop in _differing_runs(a.buf, span_a[0], b.buf, span_b[0],
+                                       common, elem_size):
+        change(start, stop, values(a, span_a, start, stop),
+               values(b, span_b, start, stop))
+    if count_a > common:
+        change(common, count_a, values(a, span_a, common, count_a), None)
+    elif count_b > common:
+        change(common, count_b, None, values(b, span_b, common, count_b))
+
+
+def _diff_list(ftype, a, b, span_a, span_b, path, changes):
+    elems_a = a.elements(ftype, *span_a)
+    elems_b = b.elements(ftype, *span_b)
+    composite = issubclass(ftype, dt.CompositeStructMixin)
+
+    for i in range(max(len(elems_a), len(elems_b))):
+        epath = path + (i,)
+        if i >= len(elems_a):
+            changes.append(Change(epath, None, b.decode(ftype, elems_b[i][0])))
+        elif i >= len(elems_b):
+            changes.append(Change(epath, a.decode(ftype, elems_a[i][0]), None))
+        elif _same_span(a, elems_a[i], b, elems_b[i]):
+            continue
+        elif composite:
+            _diff(ftype, a.buf, elems_a[i][0], a.stack,
+                  b.buf, elems_b[i][0], b.stack, epath, changes)
+        else:
+            changes.append(Change(epath,
+                                  a.decode(ftype, elems_a[i][0]),
+                                  b.decode(ftype, elems_b[i][0])))
+
+
+def _diff_fields(cls, a, b, path, changes):
+    for fname in cls.__fields__:
+        finfo = cls.__field_info__[fname]
+        span_a = a.span(fname)
+        span_b = b.span(fname)
+        if _same_span(a, span_a, b, span_b):
+            continue
+
+        if isinstance(finfo.default, dt.BitGroup):
+            _diff_bits(finfo, a, b, path, changes)
+            continue
+
+        ftype_a = a.field_type(finfo, span_a[0])
+        ftype_b = b.field_type(finfo, span_b[0])
+        fpath = path + (fname,)
+
+        if ftype_a is ftype_b and finfo.count == 1 and \
+                issubclass(ftype_a, dt.CompositeStructMixin):
+            _diff(ftype_a, a.buf, span_a[0], a.stack, b.buf, span_b[0],
+                  b.stack, fpath, changes)
+        elif ftype_a is ftype_b and finfo.count != 1:
+            if issubclass(ftype_a, dt.PrimitiveStructMixin):
+                _diff_values(ftype_a, a, b, span_a, span_b, fpath, changes)
+            else:
+                _diff_list(ftype_a, a, b, span_a, span_b, fpath, changes)
+        else:
+            # Primitive values, and fields whose type changed
+            changes.append(Change(
+                fpath,
+                a.decode_field(ftype_a, finfo, *span_a),
+                b.decode_field(ftype_b, finfo, *span_b)))
+
+
+def _diff(cls, buf_a, offset_a, stack_a, buf_b, offset_b, stack_b,
+          path, changes):
+    fixed_size = cls.__fixed_size__
+    if fixed_size is not None and \
+            _same(buf_a, offset_a, buf_b, offset_b, fixed_size):
+        return
+
+    a = _Side(cls, buf_a, offset_a, stack_a)
+    b = _Side(cls, buf_b, offset_b, stack_b)
+    if not _same_span(a, (offset_a, a.end - offset_a),
+                      b, (offset_b, b.end - offset_b)):
+        _diff_fields(cls, a, b, path, changes)
+
+
+def diff(cls, buf_a, buf_b, offset_a=0, offset_b=0):
+    """Compare the ``cls`` objects packed in ``buf_a`` and ``buf_b``.
+
+    Returns a list of ``Change`` tuples, one for each differing leaf field
+    or list element.
+    """
+    changes = []
+    _diff(cls, buf_a, offset_a, [], buf_b, offset_b, [], (), changes)
+    return changes
@@ -0,0 +1,266 @@
+import unittest
+import random
+import importlib
+import dumpy.config as dconfig
+import dumpy.types as dtypes
+import dumpy.backends as dbackends
+
+
+class Header(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('field1', dtypes.Int8),
+        dtypes.field('field2', dtypes.UInt16),
+    )
+
+
+class Body(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('field', dtypes.Int32, count=2),
+        dtypes.field('value', dtypes.Float),
+    )
+
+
+class Msg(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('header', Header),
+        dtypes.field('bodies', Body, count=2),
+        dtypes.bits('flags', dtypes.UInt16,
+                    dtypes.bit('df', 1),
+                    dtypes.bit('mf', 1),
+                    dtypes.bit('frag', 14)),
+    )
+
+
+class Record(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('type', dtypes.UInt8),
+        dtypes.field('value', dtypes.UInt32),
+    )
+
+
+class Packet(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('count', dtypes.UInt8),
+        dtypes.field('records', Record,
+                     count=dtypes.counted_by('count')),
+        dtypes.field('name', dtypes.UInt8, count=dtypes.until_byte(0)),
+        dtypes.field('trailer', Record, count=dtypes.until_field('type', 0)),
+    )
+
+
+class TestBackends(unittest.TestCase):
+    def test_registry(self):
+        self.assertEqual(dtypes.get_backend('fused').name, 'fused')
+        with self.assertRaises(ValueError):
+            dtypes.get_backend('no-such-backend')
+        with self.assertRaises(ValueError):
+            with dbackends.use_backend('no-such-backend'):
+                pass
+
+        fused = dtypes.get_backend('fused')
+        self.assertTrue(fused.supports(Msg))
+        self.assertFalse(fused.supports(Packet))
+
+        old_backend = dconfig.BACKEND
+        with dbackends.use_backend('fused'):
+            self.assertEqual(dconfig.BACKEND, 'fused')
+            # Unsupported classes fall back to the reference backend
+            p = Packet()
+            p['count'] = 0
+            p['records'] = []
+            p['name'] = [0]
+            p['trailer'] = [{'type': 0, 'value': 0}]
+            self.assertEqual(Packet.unpack(p.pack()), p)
+        self.assertEqual(dconfig.BACKEND, old_backend)
+
+    def test_fused(self):
+        m = Msg()
+        m['header'] = {'field1': -2, 'field2': 0x1234}
+        m['bodies'] = [{'field': [1, 2], 'value': 0.5},
+                       {'field': [3, -4], 'value': -1.0}]
+        m['df'] = 0
+        m['mf'] = 1
+        m['frag'] = 0x123
+
+        with dbackends.use_backend('fused'):
+            self.assertEqual(m.size, 29)
+            packed = m.pack()
+            mm = Msg.unpack(packed)
+            self.assertEqual(mm, m)
+            self.assertEqual(mm['frag'], 0x123)
+            self.assertEqual(mm['bodies'][1].parent(), mm)
+            self.assertEqual(mm['bodies'][1].offset, 15)
+
+            # Objects are reused by unpack_into, like the reference backend
+            body = mm['bodies'][0]
+            m['bodies'][0]['value'] = 2.0
+            Msg.unpack_into(mm, m.pack())
+            self.assertIs(mm['bodies'][0], body)
+            self.assertEqual(body['value'], 2.0)
+
+            with self.assertRaises(ValueError):
+                m.pack_into(bytearray(28))
+        self.assertEqual(dbackends.check_equivalence(Msg, m), m.pack())
+
+    def test_randomized(self):
+        rng = random.Random(1234)
+        for cls in (Header, Body, Msg, Packet):
+            for _i in range(50):
+                obj = dbackends.random_instance(cls, rng)
+                dbackends.check_equivalence(cls, obj)
+
+    def test_randomized_schemas(self):
+        # The schemas of the other test modules, and the demo ones
+        modules = [importlib.import_module('dumpy.tests.' + name)
+                   for name in ('test_encoder', 'test_fileio',
+                                'test_memprofile', 'test_structdiff')]
+        # The demo sets up dumpy.config for itself when imported
+        saved = (dconfig.ENDIAN, dconfig.PARENT_REFS)
+        try:
+            modules.append(importlib.import_module('demo.png_packer'))
+        finally:
+            dconfig.ENDIAN, dconfig.PARENT_REFS = saved
+
+        encoder, structdiff, png = modules[0], modules[3], modules[4]
+
+        def record_body(obj, rng):
+            body = dbackends.random_instance(
+                structdiff.get_body_type(obj), rng, generators=generators)
+            obj['len'] = body.size
+            return body
+
+        def chunk_type(_obj, rng):
+            return list(rng.choice([b'IHDR', b'deAd', b'tEXt']))
+
+        generators = {
+            (structdiff.Record, 'body'): record_body,
+            (structdiff.Raw, 'data'): random_bytes,
+            (png.PNGSignature, 'signature'):
+                lambda _obj, _rng: list(b'\x89PNG\r\n\x1a\n'),
+            (png.PNGChunk, 'type'): chunk_type,
+            (png.DataUnknown, 'data'): random_bytes,
+        }
+        # Only decodable inside the objects holding their length
+        standalone = (structdiff.Raw, png.DataUnknown)
+
+        rng = random.Random(1234)
+        checked = set()
+        for module in modules:
+            for cls in vars(module).values():
+                if not (isinstance(cls, dtypes.DumpyMeta) and
+                        issubclass(cls, dtypes.CompositeStructMixin) and
+                        cls.__module__ == module.__name__) or \
+                        cls in standalone:
+                    continue
+                for _i in range(20):
+                    obj = dbackends.random_instance(
+                        cls, rng, generators=generators)
+                    dbackends.check_equivalence(cls, obj)
+                checked.add(cls)
+        # New schemas may be added to the modules, these must stay covered
+        self.assertLessEqual(
+            {encoder.Msg, structdiff.Archive, png.PNGFile, png.PNGChunk,
+             png.DataDEAD, png.DataIHDR}, checked)
+
+
+def random_bytes(_obj, rng):
+    return [rng.getrandbits(8) for _i in range(rng.randint(0, 4))]
+
+
+@dtypes.depends('kind')
+def get_node_type(obj):
+    if obj['kind'] == 1:
+        return Node
+    return Leaf
+
+
+class Leaf(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('value', dtypes.UInt8),
+    )
+
+
+class Node(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('kind', dtypes.UInt8),
+        dtypes.field('child', dtypes.VariableType(get_node_type)),
+    )
+
+
+@dtypes.depends('kind')
+def get_tlv_type(obj):
+    if obj['kind'] == 1:
+        return TLV
+    return Leaf
+
+
+class TLV(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('kind', dtypes.UInt8),
+        dtypes.field('len', dtypes.UInt16, default=lambda o: o['value'].size),
+        dtypes.field('value', dtypes.VariableType(get_tlv_type)),
+    )
+
+
+class TestIterative(unittest.TestCase):
+    def tearDown(self):
+        dconfig.MAX_DEPTH = None
+        dconfig.MAX_ELEMENTS = None
+
+    def test_deep_nesting(self):
+        depth = 5000
+        data = b'\x01' * depth + b'\x00\x2a'
+        with dbackends.use_backend('iterative'):
+            n = Node.unpack(data)
+            self.assertEqual(n.size, len(data))
+            self.assertEqual(n.pack(), data)
+
+            leaf = n
+            for _i in range(depth):
+                leaf = leaf['child']
+            self.assertEqual(leaf['child']['value'], 0x2a)
+            self.assertEqual(leaf['child'].offset, depth + 1)
+
+            dconfig.MAX_DEPTH = 100
+            with self.assertRaises(ValueError):
+                Node.unpack(data)
+            with self.assertRaises(ValueError):
+                n.pack()
+            self.assertEqual(Node.unpack(data[-100:]).pack(), data[-100:])
+
+    def test_deep_lengths(self):
+        # Each length is the size of the nested TLV, computed when packing
+        depth = 5000
+        tlv = {'value': 0x2a}
+        for i in range(depth):
+            parent = TLV()
+            parent['kind'] = 1 if i else 0
+            parent['value'] = tlv
+            tlv = parent
+
+        with dbackends.use_backend('iterative'):
+            self.assertEqual(tlv.size, depth * 3 + 1)
+            data = tlv.pack()
+        self.assertEqual(len(data), depth * 3 + 1)
+        self.assertEqual(data[:3],
+                         b'\x01' + dtypes.UInt16(len(data) - 3).pack())
+        self.assertEqual(data[-4:],
+                         b'\x00' + dtypes.UInt16(1).pack() + b'\x2a')
+
+    def test_max_elements(self):
+        data = (b'\x01' + b'\x01\x00\x00\x00\x00' + b'a\x00' +
+                b'\x00\x00\x00\x00\x00')
+        with dbackends.use_backend('iterative'):
+            dconfig.MAX_ELEMENTS = 9
+            p = Packet.unpack(data)
+            self.assertEqual(p['name'], [ord('a'), 0])
+            self.assertEqual(p.pack(), data)
+
+            dconfig.MAX_ELEMENTS = 8
+            with self.assertRaises(ValueError):
+                Packet.unpack(data)
+
+            # A hostile count is rejected before anything is decoded
+            dconfig.MAX_ELEMENTS = 100
+            with self.assertRaises(ValueError):
+                Packet.unpack(b'\xff')
@@ -0,0 +1,81 @@
+import unittest
+import dumpy.types as dtypes
+import dumpy.batch as dbatch
+
+
+class Msg(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('id', dtypes.UInt16),
+        dtypes.field('len', dtypes.UInt8, default=dtypes.count_of('data')),
+        dtypes.field('data', dtypes.UInt8, count=dtypes.counted_by('len')),
+    )
+
+
+def make_msg(i, data):
+    m = Msg()
+    m['id'] = i
+    m['data'] = data
+    return m
+
+
+class TestEncoder(unittest.TestCase):
+    def setUp(self):
+        self.msgs = [make_msg(i, bytes(range(i % 7))) for i in range(100)]
+        self.packed = [m.pack() for m in self.msgs]
+
+    def test_unframed(self):
+        enc = dbatch.Encoder(initial_size=8)
+        enc.extend(self.msgs)
+        self.assertEqual(enc.getvalue(), b''.join(self.packed))
+        self.assertEqual(len(enc), sum(len(p) for p in self.packed))
+        self.assertEqual(enc.offsets[:3], [0, 3, 7])
+
+        msgs, end = dbatch.Decoder(Msg).decode(enc.getbuffer())
+        self.assertEqual(end, len(enc))
+        self.assertEqual([bytes(m['data']) for m in msgs],
+                         [bytes(m['data']) for m in self.msgs])
+
+        enc.reset()
+        self.assertEqual(enc.add(self.msgs[5]), 0)
+        self.assertEqual(enc.getvalue(), self.packed[5])
+
+    def test_framed(self):
+        framing = dbatch.LengthPrefix(dtypes.UInt16)
+        enc = dbatch.Encoder(framing)
+        enc.extend(self.msgs[:3])
+        data = enc.getvalue()
+        self.assertEqual(data, dtypes.UInt16(3).pack() + self.packed[0] +
+                         dtypes.UInt16(4).pack() + self.packed[1] +
+                         dtypes.UInt16(5).pack() + self.packed[2])
+
+        dec = dbatch.Decoder(Msg, framing)
+        msgs, end = dec.decode(data[:-1])
+        self.assertEqual([m['id'] for m in msgs], [0, 1])
+        self.assertEqual(end, 11)
+        msgs, end = dec.decode(data, end)
+        self.assertEqual([m['id'] for m in msgs], [2])
+        self.assertEqual(end, len(data))
+
+        with self.assertRaises(ValueError):
+            dec.decode(dtypes.UInt16(4).pack() + self.packed[0] + b'?')
+
+    def test_defaults_once(self):
+        calls = []
+
+        def data_len(obj):
+            calls.append(obj)
+            return len(obj['data'])
+
+        class Counted(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8, default=data_len),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+            )
+
+        m = Counted()
+        m['data'] = b'abc'
+        enc = dbatch.Encoder(dbatch.LengthPrefix(dtypes.UInt16))
+        enc.add(m)
+        self.assertEqual(enc.getvalue(), b'\x04\x00\x03abc')
+        self.assertEqual(len(calls), 1)
@@ -0,0 +1,151 @@
+import os
+import unittest
+import tempfile
+import dumpy.types as dtypes
+import dumpy.fileio as dfileio
+
+
+class TestCopyRange(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.src_name = os.path.join(self.tmp_dir.name, 'src')
+        self.dst_name = os.path.join(self.tmp_dir.name, 'dst')
+        self.data = bytes(range(256)) * 64
+        with open(self.src_name, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_copy_range(self):
+        with open(self.src_name, 'rb') as src, \
+                open(self.dst_name, 'wb') as dst:
+            dst.write(b'head')
+            dst.flush()
+            self.assertEqual(dfileio.copy_range(src, dst, 100, 5000), 5000)
+            dfileio.copy_range(src.fileno(), dst.fileno(), 0, 10)
+
+            with self.assertRaises(ValueError):
+                dfileio.copy_range(src, dst, len(self.data) - 1, 2)
+
+        with open(self.dst_name, 'rb') as f:
+            copied = f.read()
+        self.assertEqual(copied[:4 + 5000 + 10],
+                         b'head' + self.data[100:5100] + self.data[:10])
+
+    def test_read_write_fallback(self):
+        with open(self.src_name, 'rb') as src, \
+                open(self.dst_name, 'wb') as dst:
+            n = dfileio._read_write(src.fileno(), dst.fileno(), 3, 3000)
+        self.assertEqual(n, 3000)
+        with open(self.dst_name, 'rb') as f:
+            self.assertEqual(f.read(), self.data[3:3003])
+
+
+class Header(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('type', dtypes.UInt8, count=4),
+        dtypes.bits('flags', dtypes.UInt16,
+                    ('a', 4), ('b', 12)),
+    )
+
+
+class Record(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('len', dtypes.UInt32),
+        dtypes.field('header', Header),
+        dtypes.field('stamps', dtypes.Int32, count=2),
+        dtypes.field('data', dtypes.UInt8, count=dtypes.counted_by('len')),
+        dtypes.field('crc', dtypes.UInt32),
+    )
+
+
+class TestReadField(unittest.TestCase):
+    def test_read_field(self):
+        r = Record()
+        r['len'] = 3
+        r['header'] = Header()
+        r['header']['type'] = b'abcd'
+        r['header']['a'] = 1
+        r['header']['b'] = 0x234
+        r['stamps'] = [-1, 0x10203]
+        r['data'] = b'xyz'
+        r['crc'] = 0
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'12345' + r.pack())
+            f.flush()
+
+            self.assertEqual(dfileio.read_field(Record, f, 'len', 5), 3)
+            self.assertEqual(
+                dfileio.read_field(Record, f.fileno(), 'stamps', base=5),
+                [-1, 0x10203])
+            self.assertEqual(dfileio.read_field(Record, f, 'header', 5),
+                             r['header'])
+            self.assertEqual(dfileio.read_field(Header, f, 'b', 9), 0x234)
+            self.assertEqual(dfileio.read_field(Header, f, 'type', 9),
+                             list(b'abcd'))
+
+            with self.assertRaises(ValueError):
+                dfileio.read_field(Record, f, 'data', 5)
+            with self.assertRaises(ValueError):
+                dfileio.read_field(Record, f, 'crc', 5)
+            with self.assertRaises(ValueError):
+                dfileio.read_field(Record, f, 'stamps', 20)
+
+
+class Entry(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('type', dtypes.UInt8),
+        dtypes.field('len', dtypes.UInt8, default=dtypes.count_of('data')),
+        dtypes.field('data', dtypes.UInt8, count=dtypes.counted_by('len')),
+    )
+
+
+class Table(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('n', dtypes.UInt8),
+        dtypes.field('name', dtypes.UInt8, count=dtypes.counted_by('n')),
+        dtypes.field('entries', Entry, count=dtypes.until_field('type', 0)),
+        dtypes.field('name_end', dtypes.UInt8, count=dtypes.until_byte(0)),
+    )
+
+
+def make_entry(tp, data):
+    e = Entry()
+    e['type'] = tp
+    e['data'] = data
+    return e
+
+
+class TestAppendRecords(unittest.TestCase):
+    def test_append_records(self):
+        t = Table()
+        t['n'] = 2
+        t['name'] = b'ab'
+        t['entries'] = [make_entry(1, b'x'), make_entry(0, b'')]
+        t['name_end'] = b'cd\x00'
+        packed = t.pack()
+
+        self.assertEqual(Table.terminator_offset('entries', packed), 6)
+        self.assertEqual(Table.terminator_offset('name_end', packed), 10)
+        self.assertEqual(
+            Table.terminator_offset('entries', b'??' + packed, 2), 8)
+        with self.assertRaises(ValueError):
+            Table.terminator_offset('name', packed)
+
+        with tempfile.TemporaryFile() as f:
+            f.write(b'head' + packed + b'tail')
+            self.assertEqual(
+                dfileio.append_records(
+                    Table, f, 'entries',
+                    [make_entry(2, b'yz'), make_entry(3, b'').pack_iov(1)], 4),
+                10 + 6)
+            f.seek(0)
+            data = f.read()
+
+        t['entries'][-1:-1] = [make_entry(2, b'yz'), make_entry(3, b'')]
+        self.assertEqual(data, b'head' + t.pack() + b'tail')
+        self.assertEqual(
+            [e['type'] for e in Table.unpack_from(data, 4)['entries']],
+            [1, 2, 3, 0])
@@ -0,0 +1,58 @@
+import io
+import os
+import unittest
+import tempfile
+import contextlib
+import dumpy.types as dtypes
+import dumpy.memprofile as dmemprofile
+
+
+class Item(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('len', dtypes.UInt8, default=dtypes.count_of('data')),
+        dtypes.field('data', dtypes.UInt8, count=dtypes.counted_by('len')),
+    )
+
+
+class Bag(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('n', dtypes.UInt8, default=dtypes.count_of('items')),
+        dtypes.field('items', Item, count=dtypes.counted_by('n')),
+    )
+
+
+DATA = bytes([3]) + (bytes([4]) + b'abcd') * 3
+
+
+class TestMemProfile(unittest.TestCase):
+    def test_profile_unpack(self):
+        obj, report = dmemprofile.profile_unpack(Bag, b'??' + DATA, 2, True)
+        self.assertEqual(len(obj['items']), 3)
+        self.assertEqual(report.input_size, len(DATA))
+        self.assertGreater(report.allocated, 0)
+        self.assertGreater(report.pack_allocated, 0)
+        self.assertEqual(report.per_input_byte,
+                         report.allocated / len(DATA))
+
+        self.assertEqual(report.classes['Bag'][0], 1)
+        self.assertEqual(report.classes['Item'][0], 3)
+        self.assertGreater(report.fields[('Item', 'data')], 0)
+        self.assertGreater(report.fields[('Bag', 'items')],
+                           report.fields[('Item', 'data')])
+
+        self.assertIn('Item.data', report.format())
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            name = os.path.join(tmp_dir, 'bag')
+            with open(name, 'wb') as f:
+                f.write(DATA)
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                dmemprofile.main([__name__ + ':Bag', name, '--limit', '1'])
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split()[1], str(len(DATA)))
+        self.assertTrue(lines[-1].endswith('Bag.items'))
+
+        with self.assertRaises(ValueError):
+            dmemprofile.load_schema('dumpy.types')
@@ -0,0 +1,76 @@
+import unittest
+import threading
+import time
+import dumpy.pipeline as dpipeline
+
+
+class TestPipeline(unittest.TestCase):
+    def test_order(self):
+        def slow_double(x):
+            time.sleep(0.001 * (x % 3))
+            return x * 2
+
+        p = dpipeline.Pipeline(
+            dpipeline.Stage(slow_double, workers=4),
+            lambda x: x + 1,
+            depth=2)
+        self.assertEqual(list(p.run(range(20))),
+                         [x * 2 + 1 for x in range(20)])
+        self.assertEqual(list(dpipeline.run([], str)), [])
+
+    def test_bounded(self):
+        lock = threading.Lock()
+        read = 0
+        consumed = 0
+        max_ahead = 0
+
+        def source():
+            nonlocal read, max_ahead
+            for i in range(50):
+                with lock:
+                    read += 1
+                    max_ahead = max(max_ahead, read - consumed)
+                yield i
+
+        for _r in dpipeline.run(source(), lambda x: x,
+                                dpipeline.Stage(lambda x: x, workers=2),
+                                depth=2):
+            time.sleep(0.001)
+            with lock:
+                consumed += 1
+
+        self.assertEqual(consumed, 50)
+        # Each stage holds at most ``depth`` queued items plus one item
+        # being handed over.
+        self.assertLessEqual(max_ahead, 2 * (2 + 1) + 1)
+
+    def test_exceptions(self):
+        def check(x):
+            if x == 3:
+                raise ValueError('bad item')
+            return x
+
+        results = []
+        with self.assertRaises(ValueError):
+            for r in dpipeline.run(range(10), check, str):
+                results.append(r)
+        self.assertEqual(results, ['0', '1', '2'])
+
+        def bad_source():
+            yield 1
+            raise KeyError('source')
+
+        with self.assertRaises(KeyError):
+            list(dpipeline.run(bad_source(), str))
+
+    def test_close(self):
+        def source():
+            i = 0
+            while True:
+                yield i
+                i += 1
+
+        gen = dpipeline.run(source(), lambda x: x * 2)
+        self.assertEqual(next(gen), 0)
+        self.assertEqual(next(gen), 2)
+        gen.close()
@@ -0,0 +1,119 @@
+import unittest
+import dumpy
+import dumpy.types as dtypes
+import dumpy.structdiff as dstructdiff
+
+
+@dtypes.contextual
+def get_body_len(_obj, ctx):
+    return ctx.parent['len']
+
+
+class Raw(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('data', dtypes.UInt8, count=get_body_len),
+    )
+
+
+class Pair(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('a', dtypes.UInt8),
+        dtypes.field('b', dtypes.UInt8),
+    )
+
+
+@dtypes.depends('kind')
+def get_body_type(obj):
+    return Pair if obj['kind'] == 1 else Raw
+
+
+class Record(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('kind', dtypes.UInt8),
+        dtypes.field('len', dtypes.UInt8),
+        dtypes.field('body', dtypes.VariableType(get_body_type)),
+    )
+
+
+class Archive(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.bits('flags', dtypes.UInt8, ('x', 4), ('y', 4)),
+        dtypes.field('name', dtypes.UInt8, count=dtypes.until_byte(0)),
+        dtypes.field('records', Record, count=dtypes.until_field('kind', 0)),
+    )
+
+
+def make(flags, name, *records):
+    return bytes([flags]) + name + b'\x00' + b''.join(records) + b'\x00\x00'
+
+
+class TestStructDiff(unittest.TestCase):
+    def test_diff(self):
+        a = make(0x12, b'abc', b'\x02\x03xyz', b'\x01\x02\x05\x06')
+        self.assertEqual(dumpy.diff(Archive, a, a), [])
+        self.assertEqual(dumpy.diff(Archive, a, b'??' + a, offset_b=2), [])
+
+        b = make(0x13, b'abd', b'\x02\x03xyw', b'\x01\x02\x05\x07',
+                 b'\x02\x01q')
+        changes = dumpy.diff(Archive, a, b)
+        self.assertEqual(
+            [c.path for c in changes],
+            [('y',), ('name', 2),
+             ('records', 0, 'body', 'data', 2),
+             ('records', 1, 'body', 'b'),
+             # Lists are compared by index, so the terminating record is
+             # compared with the new one
+             ('records', 2, 'kind'),
+             ('records', 2, 'len'),
+             ('records', 2, 'body', 'data', 0),
+             ('records', 3)])
+        self.assertIsInstance(changes[0], dstructdiff.Change)
+        self.assertEqual(changes[0][1:], (2, 3))
+        self.assertEqual(changes[1][1:], (ord('c'), ord('d')))
+        self.assertEqual(changes[2][1:], (ord('z'), ord('w')))
+        self.assertEqual(changes[3][1:], (6, 7))
+        self.assertEqual(changes[6][1:], (None, ord('q')))
+        self.assertIsNone(changes[7].old)
+        self.assertEqual(changes[7].new['kind'], 0)
+
+        # The body type changes with the record kind
+        c = make(0x12, b'abc', b'\x01\x02\x05\x06', b'\x01\x02\x05\x06')
+        changes = dumpy.diff(Archive, a, c)
+        self.assertEqual([ch.path for ch in changes],
+                         [('records', 0, 'kind'), ('records', 0, 'len'),
+                          ('records', 0, 'body')])
+        self.assertEqual(changes[2].old, {'data': list(b'xyz')})
+        self.assertEqual(changes[2].new, {'a': 5, 'b': 6})
+
+        changes = dumpy.diff(Archive, c, a[:-6] + b'\x00\x00')
+        self.assertEqual(len(changes), 7)
+        self.assertEqual(changes[-1].path, ('records', 2))
+        self.assertEqual(changes[-1].old['kind'], 0)
+        self.assertIsNone(changes[-1].new)
+
+    def test_diff_values(self):
+        # Only the differing elements of primitive lists are decoded
+        data = bytes(range(256)) * 1024
+        changed = bytearray(data)
+        changed[5] = 0
+        changed[100000:100003] = b'xyz'
+        a = make(0, b'', bytes([2, 255]) + data[:255])
+        b = make(0, b'', bytes([2, 255]) + bytes(changed[:255]))
+        changes = dumpy.diff(Archive, a, b)
+        self.assertEqual(changes, [(('records', 0, 'body', 'data', 5), 5, 0)])
+
+        class Blob(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, count=dtypes.until_eof()),
+            )
+
+        changes = dumpy.diff(Blob, data, bytes(changed) + b'++')
+        self.assertEqual(
+            [c.path for c in changes],
+            [('data', 5), ('data', slice(100000, 100003)),
+             ('data', slice(len(data), len(data) + 2))])
+        self.assertEqual(changes[1][1:], (list(data[100000:100003]),
+                                          list(b'xyz')))
+        self.assertEqual(changes[2][1:], (None, list(b'++')))
+        self.assertEqual(dumpy.diff(Blob, data + b'+', data)[0][1:],
+                         (ord('+'), None))
@@ -1,9 +1,29 @@
 import unittest
+import copy
+import pickle
 import random
+import zlib
+import ctypes
 import dumpy.config as dconfig
 import dumpy.types as dtypes
 
 
+# Pickled classes can't be local to the tests
+class CopyHeader(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.bits('flags', dtypes.UInt8, ('a', 4), ('b', 4)),
+        dtypes.field('len', dtypes.UInt16),
+    )
+
+
+class CopyMsg(dict, metaclass=dtypes.DumpyMeta):
+    __field_specs__ = (
+        dtypes.field('header', CopyHeader),
+        dtypes.field('subs', CopyHeader, count=2),
+        dtypes.field('data', dtypes.UInt8, count=dtypes.until_eof()),
+    )
+
+
 class TestDumpyMeta(unittest.TestCase):
     def test_format_endian(self):
         class A(int, metaclass=dtypes.DumpyMeta):
@@ -56,6 +76,61 @@ class TestInt8(unittest.TestCase):
         self.assertEqual(i, dtypes.Int8(0x7f))
 
 
+class TestFlyweights(unittest.TestCase):
+    def test_flyweights(self):
+        self.assertEqual(len(dtypes.UInt8.__flyweights__), 256)
+        self.assertEqual(len(dtypes.Int8.__flyweights__), 256)
+        self.assertEqual(dtypes.Float.__flyweights__, ())
+
+        self.assertIs(dtypes.UInt8.unpack(b'\xff'),
+                      dtypes.UInt8.unpack(b'\xff'))
+        self.assertIs(dtypes.Int8.unpack(b'\x80'), dtypes.Int8.from_value(-128))
+        self.assertIsInstance(dtypes.Int8.from_value(-128), dtypes.Int8)
+        self.assertEqual(dtypes.Int8.from_value(-128), -128)
+
+        low, high = dconfig.FLYWEIGHT_RANGE
+        self.assertIs(dtypes.Int32.from_value(low),
+                      dtypes.Int32.from_value(low))
+        self.assertIsNot(dtypes.Int32.from_value(high),
+                         dtypes.Int32.from_value(high))
+        self.assertEqual(dtypes.Int32.from_value(high), high)
+        self.assertIsNot(dtypes.UInt32.from_value(-1),
+                         dtypes.UInt32.from_value(-1))
+
+        values = dtypes.UInt8.unpack_many(b'\x00\x01\x01', 0, 3)
+        self.assertEqual(values, [0, 1, 1])
+        self.assertIs(values[1], values[2])
+
+        class A(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, 4),
+            )
+
+        a = A()
+        a['data'] = b'\x01\x02\x02\x01'
+        self.assertIsInstance(a['data'][0], dtypes.UInt8)
+        self.assertIs(a['data'][0], a['data'][3])
+        self.assertIs(A.unpack(a.pack())['data'][1], a['data'][2])
+
+        class MyByte(dtypes.UInt8):
+            def double(self):
+                return self * 2
+
+        class B(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('byte', MyByte),
+                dtypes.field('bytes', MyByte, 2),
+            )
+
+        self.assertIs(type(MyByte.unpack(b'\x05')), MyByte)
+        self.assertIs(MyByte.from_value(5), MyByte.unpack(b'\x05'))
+        self.assertIsNot(MyByte.from_value(5), dtypes.UInt8.from_value(5))
+        self.assertIs(type(dtypes.UInt8.from_value(5)), dtypes.UInt8)
+        b = B.unpack(b'\x01\x02\x03')
+        self.assertEqual(b['byte'].double(), 2)
+        self.assertEqual([v.double() for v in b['bytes']], [4, 6])
+
+
 class TestArray(unittest.TestCase):
     def test_array(self):
         class ByteArray(tuple, metaclass=dtypes.DumpyMeta):
@@ -137,6 +212,44 @@ class TestCompositeDumpyMeta(unittest.TestCase):
         b.pack_into(bb, 1)
         self.assertEqual(bb, b'\x7e\x7f')
 
+    def test_lazy_compile(self):
+        class A(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('field1', dtypes.Int8),
+                dtypes.field('field2', dtypes.UInt16, 2),
+            )
+
+        class B(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('a', A, 2),
+                dtypes.field('len', dtypes.UInt8),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+            )
+
+        self.assertIsInstance(A.__dict__['__fields__'], dtypes._CompiledAttr)
+        self.assertIsInstance(B.__dict__['__fields__'], dtypes._CompiledAttr)
+        self.assertIsNone(B.__fixed_size__)
+        self.assertEqual(A.__dict__['__fields__'], ['field1', 'field2'])
+        self.assertEqual(A.__fixed_size__, 5)
+
+        class C(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('a', A),
+            )
+
+        dtypes.prepare(C)
+        self.assertEqual(C.__dict__['__fields__'], ['a'])
+        self.assertEqual(C.__dict__['__fixed_size__'], 5)
+
+        class D(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                ('broken',),
+            )
+
+        with self.assertRaises(IndexError):
+            D()['broken'] = 1
+
     def test_multi_level_composite(self):
         class Header(dict, metaclass=dtypes.DumpyMeta):
             __field_specs__ = (
@@ -228,6 +341,870 @@ class TestCompositeDumpyMeta(unittest.TestCase):
             A.unpack_from(b'\x02\x01\x02\x03\xff\x04').pack(),
             b'\x02\x01\x02\x03\xff')
 
+    def test_terminators(self):
+        class CString(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('str', dtypes.UInt8, count=dtypes.until_byte(0)),
+                dtypes.field('tail', dtypes.UInt8),
+            )
+
+        s = CString.unpack(b'abc\x00\x7f')
+        self.assertEqual(bytes(s['str']), b'abc\x00')
+        self.assertEqual(s['tail'], 0x7f)
+        self.assertEqual(s.pack(), b'abc\x00\x7f')
+        s = CString.unpack_from(memoryview(b'\x01\x00\x02'), 0)
+        self.assertEqual(s['str'], [1, 0])
+        self.assertEqual(s['tail'], 2)
+        # Longer than the chunks memoryview buffers are searched in
+        data = memoryview(b'\x01' * 1000 + b'\x00\x02')
+        s = CString.unpack_from(data, 0)
+        self.assertEqual(len(s['str']), 1001)
+        self.assertEqual(CString.skip(data), len(data))
+        with self.assertRaises(ValueError):
+            CString.unpack(b'abc')
+        with self.assertRaises(ValueError):
+            CString.unpack(memoryview(b'abc' * 100))
+
+        class Record(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('type', dtypes.UInt8, count=2),
+                dtypes.field('value', dtypes.Int8),
+            )
+
+        class RecordList(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('records', Record,
+                             count=dtypes.until_field('type', b'EN')),
+                dtypes.field('rest', dtypes.Int8, count=dtypes.until_eof()),
+            )
+
+        data = b'AB\x01CD\x02EN\x00\x05\x06'
+        r = RecordList.unpack(data)
+        self.assertEqual(len(r['records']), 3)
+        self.assertEqual(bytes(r['records'][1]['type']), b'CD')
+        self.assertEqual(r['records'][2]['value'], 0)
+        self.assertEqual(r['rest'], [5, 6])
+        self.assertEqual(r.pack(), data)
+
+        self.assertFalse(RecordList.__field_info__['records'].count(r))
+        r['records'] = r['records'][:2]
+        self.assertTrue(RecordList.__field_info__['records'].count(r))
+
+    def test_validation_policy(self):
+        def check_even(num, _finfo):
+            if num % 2:
+                raise ValueError('odd number')
+
+        @dtypes.vectorized
+        def check_small(values, _finfo):
+            return [i for i, v in enumerate(values) if v > 9]
+
+        class Item(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('even', dtypes.UInt8, validator=check_even),
+                dtypes.field('small', dtypes.UInt8, validator=check_small),
+            )
+
+        class List(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.bits('head', dtypes.UInt8,
+                            dtypes.bit('n', 4), dtypes.bit('e', 4,
+                                                         validator=check_even)),
+                dtypes.field('items', Item, count=dtypes.counted_by('n')),
+            )
+
+        good = b'\x32\x00\x01\x02\x02\x04\x09'
+        bad = b'\x31\x01\x01\x02\x0a\x03\x0b'
+        self.assertEqual(List.unpack(good)['items'][2]['small'], 9)
+
+        with self.assertRaises(ValueError) as cm:
+            List.unpack(bad)
+        self.assertNotIsInstance(cm.exception, dtypes.ValidationError)
+        with self.assertRaises(dtypes.ValidationError) as cm:
+            Item.unpack(b'\x00\x0a')
+        self.assertEqual(cm.exception.errors[0][0], ('small',))
+
+        with self.assertRaises(dtypes.ValidationError) as cm:
+            List.unpack_from(b'?' + bad, 1, validation='deferred')
+        self.assertEqual([path for path, _exc in cm.exception.errors],
+                         [('e',), ('items', 0, 'even'), ('items', 2, 'even'),
+                          ('items', 1, 'small'), ('items', 2, 'small')])
+        self.assertIn('items[2].even: odd number', str(cm.exception))
+
+        lst = List.unpack(bad, validation='off')
+        self.assertEqual(lst['items'][2]['small'], 11)
+        with self.assertRaises(dtypes.ValidationError) as cm:
+            lst.validate()
+        self.assertEqual(len(cm.exception.errors), 5)
+        lst['e'] = 2
+        for item, (even, small) in zip(lst['items'], [(0, 1), (2, 2), (4, 9)]):
+            item['even'] = even
+            item['small'] = small
+        lst.validate()
+
+        List.unpack_into(lst, good, validation='deferred')
+        with self.assertRaises(dtypes.ValidationError):
+            List.unpack_into(lst, bad, validation='deferred')
+        with self.assertRaises(ValueError):
+            List.unpack(good, validation='lazy')
+
+        # Cached objects decoded without validation are validated on reuse
+        Item.enable_parse_cache()
+        try:
+            self.assertEqual(Item.unpack(b'\x01\x00', validation='off'),
+                             {'even': 1, 'small': 0})
+            with self.assertRaises(dtypes.ValidationError):
+                Item.unpack(b'\x01\x00', validation='deferred')
+            with self.assertRaises(ValueError):
+                Item.unpack(b'\x01\x00')
+            with self.assertRaises(ValueError):
+                List.unpack(b'\x10\x01\x00')
+            item = Item.unpack(b'\x02\x00')
+            self.assertIs(Item.unpack(b'\x02\x00', validation='deferred'),
+                          item)
+            self.assertIs(Item.unpack(b'\x02\x00', validation='off'), item)
+
+            # Deferred unpacks reuse objects once their validators passed
+            item = Item.unpack(b'\x04\x00', validation='deferred')
+            self.assertIs(Item.unpack(b'\x04\x00'), item)
+            with self.assertRaises(dtypes.ValidationError):
+                Item.unpack(b'\x03\x00', validation='deferred')
+            with self.assertRaises(ValueError):
+                Item.unpack(b'\x03\x00')
+        finally:
+            Item.disable_parse_cache()
+
+        class Plain(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('x', dtypes.UInt8),
+            )
+
+        Plain.enable_parse_cache()
+        try:
+            p = Plain.unpack(b'\x01', validation='off')
+            self.assertIs(Plain.unpack(b'\x01', validation='deferred'), p)
+            self.assertIs(Plain.unpack(b'\x01'), p)
+            self.assertEqual(Plain.parse_cache_info()[:2], (2, 1))
+
+            Item.enable_parse_cache()
+            Item.unpack(b'\x06\x00', validation='off')
+            Item.unpack(b'\x06\x00')
+            self.assertEqual(Item.parse_cache_info()[:2], (0, 2))
+        finally:
+            Plain.disable_parse_cache()
+            Item.disable_parse_cache()
+
+        class Fixed(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, count=2),
+            )
+
+        f = Fixed()
+        with self.assertRaises(ValueError):
+            f['data'] = [1, 2, 3]
+        dconfig.VALIDATION = 'off'
+        try:
+            f['data'] = [1, 2, 3]
+        finally:
+            dconfig.VALIDATION = 'eager'
+        with self.assertRaises(ValueError):
+            f.pack()
+
+    def test_bits(self):
+        def check_version(v, _finfo):
+            if v != 4:
+                raise ValueError('bad version')
+
+        class A(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.bits('ver_ihl', dtypes.UInt8,
+                            dtypes.bit('version', 4, validator=check_version),
+                            ('ihl', 4)),
+                dtypes.bits('flags', dtypes.UInt16,
+                            dtypes.bit('df', 1),
+                            dtypes.bit('mf', 1),
+                            dtypes.bit('frag', 14)),
+            )
+
+        a = A()
+        self.assertEqual(a['version'], 0)
+        self.assertEqual(a.size, 3)
+        a['version'] = 4
+        a['ihl'] = 5
+        a['mf'] = 1
+        a['frag'] = 0x123
+        self.assertEqual(a['ver_ihl'], 0x45)
+        if dconfig.ENDIAN == '<':
+            self.assertEqual(a.pack(), b'\x45\x23\x41')
+        elif dconfig.ENDIAN == '>':
+            self.assertEqual(a.pack(), b'\x45\x41\x23')
+
+        b = A.unpack(a.pack())
+        self.assertEqual(b['version'], 4)
+        self.assertEqual(b['ihl'], 5)
+        self.assertEqual(b['df'], 0)
+        self.assertEqual(b['mf'], 1)
+        self.assertEqual(b['frag'], 0x123)
+        self.assertEqual(b.pack(), a.pack())
+
+        b['ver_ihl'] = 0x46
+        self.assertEqual(b['ihl'], 6)
+
+        with self.assertRaises(ValueError):
+            a['ihl'] = 16
+        with self.assertRaises(TypeError):
+            a['ihl'] = [1]
+        with self.assertRaises(ValueError):
+            A.unpack(b'\x55\x00\x00')
+
+        with self.assertRaises(ValueError):
+            dtypes.bits('x', dtypes.UInt8, ('a', 4), ('b', 5))
+        with self.assertRaises(ValueError):
+            dtypes.bits('x', dtypes.UInt8, ('a', 4))
+        with self.assertRaises(TypeError):
+            dtypes.bits('x', dtypes.Float, ('a', 32))
+
+        # Signed storage words hold the bits in two's complement
+        class F(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.bits('f', dtypes.Int8, ('a', 1), ('b', 7)),
+            )
+
+        f = F.unpack(b'\x81')
+        self.assertEqual((f['a'], f['b']), (1, 1))
+        self.assertEqual(f['f'], -127)
+        self.assertEqual(f.pack(), b'\x81')
+        f['b'] = 0
+        self.assertEqual(f.pack(), b'\x80')
+
+    def test_parse_cache(self):
+        class Header(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('type', dtypes.UInt8),
+                dtypes.field('flags', dtypes.UInt8, 2),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('header', Header),
+                dtypes.field('len', dtypes.UInt8),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+            )
+
+        self.assertIsNone(Header.parse_cache_info())
+
+        Header.enable_parse_cache(maxsize=2)
+        m1 = Msg.unpack(b'\x01\x02\x03\x01\xff')
+        m2 = Msg.unpack(b'\x01\x02\x03\x00')
+        self.assertIs(m1['header'], m2['header'])
+        self.assertEqual(m1['header'], {'type': 1, 'flags': [2, 3]})
+        self.assertEqual(Header.parse_cache_info(),
+                         dtypes.CacheInfo(1, 1, 0, 2, 1))
+
+        Header.unpack(b'\x02\x00\x00')
+        Header.unpack(b'\x03\x00\x00')
+        self.assertEqual(Header.parse_cache_info(),
+                         dtypes.CacheInfo(1, 3, 1, 2, 2))
+
+        h = m1['header']
+        with self.assertRaises(TypeError):
+            h['type'] = 2
+        with self.assertRaises(TypeError):
+            h['flags'].append(4)
+        with self.assertRaises(TypeError):
+            h.update({'type': 2})
+        with self.assertRaises(TypeError):
+            del h['type']
+        self.assertEqual(h.pack(), b'\x01\x02\x03')
+
+        m1['header'] = {'type': 5, 'flags': [0, 0]}
+        self.assertEqual(m1.pack(), b'\x05\x00\x00\x01\xff')
+
+        Header.disable_parse_cache()
+        self.assertIsNot(Header.unpack(b'\x02\x00\x00'),
+                         Header.unpack(b'\x02\x00\x00'))
+
+        Msg.enable_parse_cache()
+        m1 = Msg.unpack(b'\x01\x02\x03\x01\xff\x00')
+        m2 = Msg.unpack_from(b'\x00\x01\x02\x03\x01\xff', 1)
+        self.assertIs(m1, m2)
+        self.assertEqual(Msg.parse_cache_info().hits, 1)
+        Msg.disable_parse_cache()
+
+        class Padded(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('pad', dtypes.UInt8, 4, 0),
+            )
+
+        p = Padded()
+        p['pad'] = [1]
+        p.freeze()
+        self.assertEqual(p.pack(), b'\x01\x00\x00\x00')
+        self.assertEqual(p['pad'], [1, 0, 0, 0])
+
+    def test_unpack_into(self):
+        class Body(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('field', dtypes.Int8),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('fixed', dtypes.UInt8, 2),
+                dtypes.field('len', dtypes.UInt8),
+                dtypes.field('bodies', Body, count=dtypes.counted_by('len')),
+            )
+
+        m = Msg.unpack(b'\x01\x02\x02\x03\x04')
+        fixed = m['fixed']
+        bodies = m['bodies']
+        body0 = bodies[0]
+
+        self.assertIs(Msg.unpack_into(m, b'\x05\x06\x01\x07'), m)
+        self.assertEqual(m, {'fixed': [5, 6], 'len': 1,
+                             'bodies': [{'field': 7}]})
+        self.assertIs(m['fixed'], fixed)
+        self.assertIs(m['bodies'], bodies)
+        self.assertIs(m['bodies'][0], body0)
+        self.assertEqual(m['bodies'][0].parent(), m)
+
+        Msg.unpack_into(m, b'\x05\x06\x03\x07\x08\x09')
+        self.assertEqual(m['bodies'], [{'field': 7}, {'field': 8},
+                                       {'field': 9}])
+        self.assertEqual(m.pack(), b'\x05\x06\x03\x07\x08\x09')
+
+        with self.assertRaises(TypeError):
+            Msg.unpack_into(Body(), b'\x00\x00\x00')
+        with self.assertRaises(TypeError):
+            Msg.unpack_into(m.freeze(), b'\x00\x00\x00')
+
+        # Sub-objects report where they end, they aren't sized again
+        sized = []
+
+        class Sized(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+            )
+
+            @property
+            def size(self):
+                sized.append(self)
+                return super().size
+
+        class List(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('pair', Sized, count=2),
+                dtypes.field('items', Sized, count=dtypes.until_eof()),
+            )
+
+        data = b'\x01a\x02bc\x00\x01d'
+        lst = List.unpack(data[:5])
+        List.unpack_into(lst, data)
+        self.assertEqual(lst['pair'][1]['data'], list(b'bc'))
+        self.assertEqual(len(lst['items']), 2)
+        self.assertEqual(lst['items'][1]['data'], [ord('d')])
+        self.assertEqual(List.unpack_frozen(data).size, len(data))
+        self.assertEqual(sized, [])
+
+    def test_unpack_frozen(self):
+        class Body(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('field', dtypes.Int8),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8,
+                             default=dtypes.count_of('bodies')),
+                dtypes.field('bodies', Body, count=dtypes.counted_by('len')),
+            )
+
+        data = b'??\x02\x01\x02'
+        m = Msg.unpack_frozen(data, 2)
+        self.assertEqual(m._packed, data[2:])
+        self.assertIs(m.pack(), m.pack())
+        self.assertEqual(m.size, 3)
+        buf = bytearray(4)
+        m.pack_into(buf, 1)
+        self.assertEqual(buf, b'\x00' + data[2:])
+        self.assertEqual(b''.join(m.pack_iov()), data[2:])
+        with self.assertRaises(TypeError):
+            m['len'] = 1
+        with self.assertRaises(TypeError):
+            m['bodies'].append(Body())
+
+        m2 = Msg.unpack(data[2:]).freeze()
+        self.assertIsNone(m2._packed)
+        self.assertEqual(m2, m)
+        self.assertFalse(m2 != m)
+        self.assertEqual(len({m, m2, Msg.unpack_frozen(b'\x00')}), 2)
+        self.assertEqual(m['bodies'][1], Body.unpack_frozen(b'\x02'))
+
+        mutable = Msg.unpack(data[2:])
+        self.assertEqual(mutable, m)
+
+        # Objects that can't be packed compare their fields
+        self.assertEqual(Body().freeze(), Body().freeze())
+        body = Body()
+        body['field'] = 1
+        self.assertNotEqual(body.freeze(), Body().freeze())
+        with self.assertRaises(TypeError):
+            hash(mutable)
+
+        Msg.enable_parse_cache()
+        self.assertIs(Msg.unpack_frozen(data, 2), Msg.unpack_frozen(data, 2))
+        self.assertEqual(Msg.unpack_from(data, 2)._packed, data[2:])
+        Msg.disable_parse_cache()
+
+    def test_copy(self):
+        Msg = CopyMsg
+        data = b'\x12\x00\x03\x34\x00\x05\x56\x00\x07abc'
+        m = Msg.unpack_frozen(data)
+
+        for c in (copy.deepcopy(m), pickle.loads(pickle.dumps(m))):
+            self.assertEqual(c.pack(), data)
+            self.assertFalse(c._frozen)
+            self.assertFalse(c['subs'][1]._frozen)
+            self.assertIs(c['subs'][1].parent(), c)
+            c['subs'][1]['a'] = 9
+            c['data'].append(100)
+            self.assertEqual(c['subs'][1]['a'], 9)
+            self.assertEqual(m.pack(), data)
+
+        # Shallow copies share the frozen sub-objects
+        c = copy.copy(m)
+        self.assertFalse(c._frozen)
+        self.assertIs(c['header'], m['header'])
+        c['data'] = b'xy'
+        self.assertEqual(c.pack(), data[:-3] + b'xy')
+        self.assertEqual(m['data'], list(b'abc'))
+
+        # Mutable objects are copied too
+        c = copy.deepcopy(Msg.unpack(data))
+        self.assertEqual(c.pack(), data)
+
+    def test_pool(self):
+        class Body(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('field', dtypes.Int8),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8),
+                dtypes.field('bodies', Body, count=dtypes.counted_by('len')),
+            )
+
+        Msg.enable_pool(maxsize=1)
+        Body.enable_pool()
+
+        m = Msg.unpack(b'\x02\x01\x02')
+        bodies = m['bodies']
+        body1 = bodies[1]
+        Msg().release()
+        m.release()
+
+        m2 = Msg.unpack(b'\x01\x03')
+        self.assertIs(m2, m)
+        self.assertIs(m2['bodies'], bodies)
+        self.assertEqual(m2, {'len': 1, 'bodies': [{'field': 3}]})
+
+        # The dropped sub-object went to its own pool
+        m3 = Msg.unpack(b'\x02\x04\x05')
+        self.assertIsNot(m3, m)
+        self.assertIs(m3['bodies'][0], body1)
+        self.assertEqual(m3, {'len': 2, 'bodies': [{'field': 4},
+                                                   {'field': 5}]})
+        self.assertEqual(m3['bodies'][1].parent(), m3)
+
+        # Objects are only pooled once
+        Msg.enable_pool(maxsize=2)
+        m3.release()
+        m3.release()
+        self.assertIs(Msg.unpack(b'\x00'), m3)
+        self.assertIsNot(Msg.unpack(b'\x00'), m3)
+
+        Msg.disable_pool()
+        Body.disable_pool()
+        m3.release()
+        self.assertIsNot(Msg.unpack(b'\x00'), m3)
+
+    def test_skip(self):
+        @dtypes.depends('type')
+        def get_type(obj):
+            if obj['type'] == 0:
+                return Short
+            else:
+                return Long
+
+        class Short(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('value', dtypes.Int8),
+            )
+
+        class Long(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+            )
+
+        class Record(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('type', dtypes.UInt8),
+                dtypes.field('body', dtypes.VariableType(get_type)),
+                dtypes.field('name', dtypes.UInt8,
+                             count=dtypes.until_byte(0)),
+            )
+
+        class File(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('magic', dtypes.UInt8, 4),
+                dtypes.field('records', Record,
+                             count=dtypes.until_field('type', 2)),
+                dtypes.field('trailer', Short, 2),
+            )
+
+        self.assertEqual(Record.__skip_needed__, frozenset(['type']))
+        self.assertEqual(Long.__skip_needed__, frozenset(['len']))
+
+        data = (b'MAGC'
+                b'\x00\x7f' b'a\x00'
+                b'\x01\x03xyz' b'bc\x00'
+                b'\x02\x00' b'\x00'
+                b'\x01\x02'
+                b'extra')
+        end = len(data) - len(b'extra')
+        self.assertEqual(File.skip(data), end)
+        self.assertEqual(File.skip(data, 0), File.unpack(data).size)
+        self.assertEqual(File.measure(b'__' + data, 2), end)
+        self.assertEqual(Record.skip(data, 4), 8)
+        self.assertEqual(Short.skip(data, 0), 1)
+
+        obj, rec_end = Record._skip_from(data, 8, None)
+        self.assertEqual(rec_end, 16)
+        self.assertEqual(obj['type'], 1)
+        self.assertNotIn('name', obj)
+
+        with self.assertRaises(ValueError):
+            File.skip(data[:end - 1])
+
+    def test_field_span(self):
+        class Header(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.bits('flags', dtypes.UInt8,
+                            ('a', 4), ('b', 4)),
+                dtypes.field('len', dtypes.UInt8),
+            )
+
+        @dtypes.depends('header')
+        def data_len(obj):
+            return obj['header']['len']
+
+        class Msg2(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('header', Header),
+                dtypes.field('data', dtypes.UInt8, count=data_len),
+                dtypes.field('crc', dtypes.UInt8, 2),
+            )
+
+        data = b'__\x12\x03abc\x00\x01'
+        m = Msg2.unpack_from(data, 2)
+        self.assertEqual(m.field_span('header'), (2, 2))
+        self.assertEqual(m.field_span('data'), (4, 3))
+        self.assertEqual(m.field_span('crc'), (7, 2))
+        self.assertEqual(m['header'].field_span('len'), (3, 1))
+        self.assertEqual(m['header'].field_span('b'), (2, 1))
+
+        m['data'] = b'abcd'
+        m['header']['len'] = 4
+        self.assertEqual(m.field_span('crc'), (8, 2))
+        self.assertEqual(Msg2(m).field_span('crc'), (6, 2))
+
+        p = Msg2.peek(data, 2)
+        self.assertEqual(p['header']['len'], 3)
+        self.assertNotIn('data', p)
+        self.assertEqual(p.field_span('data'), (4, 3))
+        self.assertEqual(p.field_span('crc'), (7, 2))
+
+        p = Msg2.peek(data, 2, fields=['crc'])
+        self.assertEqual(p['crc'], [0, 1])
+
+    def test_contextual(self):
+        contexts = []
+
+        @dtypes.contextual
+        def data_count(obj, ctx):
+            contexts.append((ctx.root, ctx.parent, ctx.offset, len(ctx.stack)))
+            return ctx.parent['length']
+
+        class Data(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, count=data_count),
+            )
+
+        class Chunk(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('length', dtypes.UInt8,
+                             default=lambda o: o['data'].size),
+                dtypes.field('data', Data),
+            )
+
+        class File(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('chunks', Chunk, count=2),
+            )
+
+        data = b'\x02ab\x01c'
+        old_parent_refs = dconfig.PARENT_REFS
+        dconfig.PARENT_REFS = False
+        try:
+            f = File.unpack(data)
+            self.assertIsNone(f['chunks'][1]['data'].parent)
+            self.assertEqual(f['chunks'][1]['data']['data'], [ord('c')])
+            root, parent, offset, depth = contexts[-1]
+            self.assertIs(root, f)
+            self.assertIs(parent, f['chunks'][1])
+            self.assertEqual(offset, 4)
+            self.assertEqual(depth, 3)
+
+            self.assertEqual(File.skip(data), len(data))
+
+            c = Chunk()
+            c['data'] = Data()
+            c['data']['data'] = b'xyz'
+            self.assertIsNone(c['data'].parent)
+            self.assertEqual(c.pack(), b'\x03xyz')
+        finally:
+            dconfig.PARENT_REFS = old_parent_refs
+
+        # Outside of pack and unpack, the context comes from parent refs
+        f = File.unpack(data)
+        del contexts[:]
+        self.assertEqual(
+            dtypes._call(data_count, f['chunks'][0]['data']), 2)
+        self.assertIs(contexts[-1][0], f)
+        self.assertEqual(contexts[-1][2:], (1, 3))
+
+        # skip and peek decode the parent fields read through the context
+        @dtypes.contextual
+        def sub_count(obj, ctx):
+            return ctx.parent['hdr'][1]
+
+        class Sub(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, count=sub_count),
+            )
+
+        class Outer(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('hdr', dtypes.UInt8, 2),
+                dtypes.field('subs', Sub, count=dtypes.until_eof()),
+            )
+
+        data = b'\x00\x02ab\x01\x02'
+        self.assertEqual(Outer.unpack(data)['subs'][1]['data'], [1, 2])
+        self.assertEqual(Outer.skip(data), len(data))
+        self.assertEqual(Outer.peek(data)['hdr'], [0, 2])
+        self.assertEqual(Outer.peek(data).field_span('subs'), (2, 4))
+
+        # Parents passed in directly are part of the context too
+        outer = Outer(hdr=[0, 2])
+        self.assertEqual(Sub.unpack_from(b'ab', 0, outer)['data'], [97, 98])
+        self.assertEqual(Sub._skip_from(b'ab', 0, outer)[1], 2)
+        old_parent_refs = dconfig.PARENT_REFS
+        dconfig.PARENT_REFS = False
+        try:
+            self.assertEqual(Sub.unpack_from(b'ab', 0, outer)['data'],
+                             [97, 98])
+        finally:
+            dconfig.PARENT_REFS = old_parent_refs
+
+    def test_compressed(self):
+        class Inner(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, count=dtypes.until_eof()),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8,
+                             default=lambda o: o['payload'].size),
+                dtypes.field('payload',
+                             dtypes.compressed(Inner,
+                                               length=dtypes.counted_by('len'))),
+                dtypes.field('raw', dtypes.compressed()),
+            )
+
+        payload = zlib.compress(b'abc' * 10)
+        raw = zlib.compress(b'xyz' * 1000, 9)
+        data = bytes([len(payload)]) + payload + raw
+
+        m = Msg.unpack(data)
+        self.assertEqual(m['payload'].raw, payload)
+        self.assertIsNone(m['payload']._data)
+        self.assertEqual(m['payload'].value['data'], list(b'abc' * 10))
+        self.assertEqual(b''.join(m['raw'].iter_data(100)), b'xyz' * 1000)
+        self.assertIsNone(m['raw']._data)
+        self.assertEqual(m['raw'].data, b'xyz' * 1000)
+        with self.assertRaises(TypeError):
+            m['raw'].value
+
+        # Unmodified payloads are not recompressed
+        self.assertEqual(m.pack(), data)
+        self.assertEqual(Msg.skip(data), len(data))
+        self.assertEqual(Msg.peek(data).field_span('raw'),
+                         (len(payload) + 1, len(raw)))
+
+        m['payload'].value['data'] = b'abcd'
+        m['raw'] = b'123'
+        m['len'] = m['payload'].size
+        packed = m.pack()
+        self.assertNotEqual(packed, data)
+        mm = Msg.unpack(packed)
+        self.assertEqual(bytes(mm['payload'].value['data']), b'abcd')
+        self.assertEqual(mm['raw'].data, b'123')
+        self.assertEqual(mm, m)
+
+        i = Inner()
+        i['data'] = b'new'
+        m['payload'] = i
+        self.assertEqual(Msg.unpack(m.pack())['payload'].data, b'new')
+
+        with self.assertRaises(ValueError):
+            Msg.unpack(data[:10])
+
+    def test_pack_iov(self):
+        class Sub(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('a', dtypes.UInt16),
+                dtypes.field('b', dtypes.UInt8, count=2),
+            )
+
+        class Blob(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt32,
+                             default=dtypes.count_of('data')),
+                dtypes.field('sub', Sub),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+                dtypes.field('crc', dtypes.UInt32, default=0),
+                dtypes.field('z', dtypes.compressed()),
+            )
+
+        b = Blob()
+        b['sub'] = Sub()
+        b['sub']['a'] = 1
+        b['sub']['b'] = [2, 3]
+        b['data'] = bytes(range(256)) * 8
+        b['z'] = b'x' * 100
+
+        iov = b.pack_iov(min_size=16)
+        self.assertEqual(b''.join(iov), b.pack())
+        self.assertEqual([type(v) for v in iov],
+                         [bytearray, memoryview, bytearray])
+        self.assertEqual(len(iov[0]), 8)
+
+        iov = b.pack_iov(min_size=5)
+        self.assertEqual(b''.join(iov), b.pack())
+        self.assertEqual(len(iov), 4)
+        self.assertIs(iov[-1].obj, b['z'].raw)
+
+        self.assertEqual(b''.join(b.pack_iov(min_size=1 << 20)), b.pack())
+
+    def test_offset_of(self):
+        class Header(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('type', dtypes.UInt8, count=4),
+                dtypes.bits('flags', dtypes.UInt16,
+                            ('a', 8), ('b', 8)),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt32),
+                dtypes.field('header', Header, count=2),
+                dtypes.field('none', dtypes.UInt8, count=0),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+                dtypes.field('crc', dtypes.UInt32),
+            )
+
+        self.assertEqual(Header.offset_of('b'), 4)
+        self.assertEqual(Msg.offset_of('len'), 0)
+        self.assertEqual(Msg.offset_of('header'), 4)
+        self.assertEqual(Msg.offset_of('none'), 16)
+        self.assertEqual(Msg.offset_of('data'), 16)
+        with self.assertRaises(ValueError):
+            Msg.offset_of('crc')
+        with self.assertRaises(KeyError):
+            Msg.offset_of('nothing')
+
+    def test_ctypes(self):
+        class Header(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.bits('flags', dtypes.UInt8,
+                            ('a', 4), ('b', 4)),
+                dtypes.field('len', dtypes.UInt16),
+            )
+
+        class Msg(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('header', Header),
+                dtypes.field('values', dtypes.Int32, count=2),
+                dtypes.field('ratio', dtypes.Float),
+                dtypes.field('tag', dtypes.UInt8, count=4),
+                dtypes.field('subs', Header, count=2),
+            )
+
+        m = Msg()
+        m['header'] = {'a': 1, 'b': 2, 'len': 0x1234}
+        m['values'] = [-1, 0x10203]
+        m['ratio'] = 0.5
+        m['tag'] = b'\x01\x02\x03\x04'
+        m['subs'] = [{'a': 3, 'b': 4, 'len': 5}, {'a': 5, 'b': 6, 'len': 7}]
+
+        CMsg = Msg.as_ctypes()
+        self.assertIs(Msg.as_ctypes(), CMsg)
+        self.assertEqual(ctypes.sizeof(CMsg), m.size)
+
+        c = m.to_ctypes()
+        self.assertEqual(bytes(c), m.pack())
+        self.assertEqual(c.header.flags, 0x12)
+        self.assertEqual(Msg.from_ctypes(c), m)
+
+        buf = bytearray(2) + m.pack()
+        c = CMsg.from_buffer(buf, 2)
+        self.assertEqual(c.values[1], 0x10203)
+        c.subs[1].len = 8
+        self.assertEqual(Msg.unpack_from(buf, 2)['subs'][1]['len'], 8)
+        self.assertEqual(Msg.from_ctypes(c)['subs'][1]['b'], 6)
+
+        class LittleUInt16(int, metaclass=dtypes.DumpyMeta):
+            __spec__ = '<H'
+
+        class BigUInt16(int, metaclass=dtypes.DumpyMeta):
+            __spec__ = '>H'
+
+        class Mixed(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('little', LittleUInt16),
+                dtypes.field('big', BigUInt16),
+            )
+
+        class Variable(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('data', dtypes.UInt8, dtypes.until_eof()),
+            )
+
+        with self.assertRaises(TypeError):
+            Mixed.as_ctypes()
+        with self.assertRaises(TypeError):
+            Variable.as_ctypes()
+
     def test_variable_type(self):
         def get_type(obj):
             if obj['type'] == 0:
@@ -306,6 +1283,63 @@ class TestCompositeDumpyMeta(unittest.TestCase):
         self.assertEqual(b['len'], 3)
         self.assertEqual(b.pack(), b'\x03\x03\x02\x01')
 
+    def test_default_memo(self):
+        calls = []
+
+        def counted(func):
+            def counted_func(obj):
+                calls.append(func)
+                return func(obj)
+            counted_func.depends = getattr(func, 'depends', ())
+            return counted_func
+
+        class Inner(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('len', dtypes.UInt8,
+                             default=counted(dtypes.count_of('data'))),
+                dtypes.field('data', dtypes.UInt8,
+                             count=dtypes.counted_by('len')),
+            )
+
+        class Outer(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('total', dtypes.UInt8,
+                             default=counted(
+                                 dtypes.depends('len')(
+                                     lambda o: o['len'] + o['inner'].size))),
+                dtypes.field('len', dtypes.UInt8,
+                             default=counted(lambda o: o['inner'].size)),
+                dtypes.field('inner', Inner),
+            )
+
+        self.assertEqual(Outer.__computed__, ['len', 'total'])
+
+        o = Outer()
+        o['inner'] = Inner()
+        o['inner']['data'] = b'abc'
+        self.assertEqual(o.pack(), b'\x08\x04\x03abc')
+        self.assertEqual(len(calls), 3)
+
+        del calls[:]
+        o.pack_into(bytearray(6))
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(o.size, 6)
+
+        # Outside of a pack, defaults are computed on every access
+        o['inner']['data'] = b'abcd'
+        self.assertEqual(o['len'], 5)
+
+        class Loop(dict, metaclass=dtypes.DumpyMeta):
+            __field_specs__ = (
+                dtypes.field('a', dtypes.UInt8,
+                             default=dtypes.count_of('b')),
+                dtypes.field('b', dtypes.UInt8, count=2,
+                             default=dtypes.depends('a')(lambda o: 0)),
+            )
+
+        with self.assertRaises(ValueError):
+            Loop.__fields__
+
     def test_exceptions(self):
         with self.assertRaises(RuntimeError):
             dtypes.NoDefault()
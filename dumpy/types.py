@@ -1,11 +1,27 @@
+import copy
+import zlib
 import struct
 import weakref
+import threading
 import collections
 from collections import abc
-from .config import ENDIAN
+from . import config
+from .config import ENDIAN, FLYWEIGHT_RANGE
 
 
 class PrimitiveStructMixin:
+    # Shared instances for small values, see ``DumpyMeta._new_flyweights``
+    __flyweights__ = ()
+    __flyweight_base__ = 0
+
+    @classmethod
+    def from_value(cls, value):
+        if isinstance(value, int):
+            idx = value - cls.__flyweight_base__
+            if 0 <= idx < len(cls.__flyweights__):
+                return cls.__flyweights__[idx]
+        return cls(value)
+
     def pack(self):
         return self.__struct__.pack(self)
 
@@ -15,12 +31,35 @@ class PrimitiveStructMixin:
     @classmethod
     def unpack(cls, buf):
         (value,) = cls.__struct__.unpack(buf)
-        return cls(value)
+        return cls.from_value(value)
 
     @classmethod
     def unpack_from(cls, buf, offset=0, parent=None):
         (value,) = cls.__struct__.unpack_from(buf, offset)
-        return cls(value)
+        return cls.from_value(value)
+
+    @classmethod
+    def unpack_many(cls, buf, offset, count):
+        fmt = cls.__struct__.format
+        if isinstance(fmt, bytes):
+            fmt = fmt.decode()
+        values = struct.unpack_from(
+            '{}{}{}'.format(fmt[0], count, fmt[1:]), buf, offset)
+        table = cls.__flyweights__
+        if not table:
+            return [cls(v) for v in values]
+        base = cls.__flyweight_base__
+        n = len(table)
+        return [table[v - base] if 0 <= v - base < n else cls(v)
+                for v in values]
+
+    @classmethod
+    def pack_many(cls, values):
+        fmt = cls.__struct__.format
+        if isinstance(fmt, bytes):
+            fmt = fmt.decode()
+        return struct.pack(
+            '{}{}{}'.format(fmt[0], len(values), fmt[1:]), *values)
 
     @property
     def size(self):
@@ -28,6 +67,10 @@ class PrimitiveStructMixin:
 
 
 class SequenceStructMixin:
+    @classmethod
+    def from_value(cls, value):
+        return cls(value)
+
     def pack(self):
         return self.__struct__.pack(*self)
 
@@ -60,33 +103,865 @@ def field(name, tp, count=1, default=NoDefault, validator=None):
     return (name, tp, count, default, validator)
 
 
+def depends(*names):
+    """Declare the fields a count, default or type callable reads.
+
+    Without this declaration, ``skip`` has to decode every field that
+    precedes the one using the callable. Only fields of the object itself
+    can be named, contextual callables reading the enclosing objects should
+    not declare their dependencies.
+    """
+    def depends_decorator(func):
+        func.depends = names
+        return func
+    return depends_decorator
+
+
 def counted_by(name):
+    @depends(name)
     def counted_by_func(obj):
         return obj[name]
     return counted_by_func
 
 
 def count_of(name):
+    @depends(name)
     def count_of_func(obj):
         return len(obj[name])
     return count_of_func
 
 
+def contextual(func):
+    """Mark a count, default or type callable as taking a ``ParseContext``
+    as its second argument.
+
+    Unlike ``obj.parent``, the context works when ``dumpy.config.PARENT_REFS``
+    is turned off.
+    """
+    func.contextual = True
+    return func
+
+
+class ParseContext:
+    """Where an object is in the object tree being packed or unpacked.
+
+    ``stack`` holds the enclosing objects, from the root down to the object
+    itself, and ``offset`` is the current offset in the buffer, or ``None``
+    if it's unknown.
+    """
+
+    __slots__ = ('stack', 'offset')
+
+    def __init__(self, stack, offset):
+        self.stack = stack
+        self.offset = offset
+
+    @property
+    def parent(self):
+        if len(self.stack) < 2:
+            return None
+        return self.stack[-2]
+
+    @property
+    def root(self):
+        return self.stack[0]
+
+
+class _ObjectStack(threading.local):
+    """The objects being packed or unpacked in the current thread."""
+
+    def __init__(self):
+        self.objs = []
+        # The ``_PackMemo`` of the outermost pack, pack_into or size call
+        self.memo = None
+        # The ``_Validation`` of the outermost unpack call
+        self.validation = None
+
+
+class _PackMemo:
+    """Computed defaults and sizes, evaluated once per pack.
+
+    Objects are kept in ``objs`` until the pack is done, so that their ids
+    can't be reused by other objects in the mean time.
+    """
+
+    __slots__ = ('objs', 'defaults', 'sizes')
+
+    def __init__(self):
+        self.objs = {}
+        self.defaults = {}
+        self.sizes = {}
+
+
+_object_stack = _ObjectStack()
+
+
+def _context_for(obj, offset):
+    objs = _object_stack.objs
+    for i in range(len(objs) - 1, -1, -1):
+        if objs[i] is obj:
+            stack = objs[:i + 1]
+            break
+    else:
+        # Not being packed or unpacked
+        stack = [obj]
+    # Objects at the bottom of the stack may still have parents, follow
+    # the parent references
+    parent_ref = stack[0].parent
+    while parent_ref is not None:
+        parent = parent_ref()
+        if parent is None:
+            break
+        stack.insert(0, parent)
+        parent_ref = parent.parent
+
+    if offset is None:
+        offset = obj.offset
+    return ParseContext(stack, offset)
+
+
+def _enter(obj, parent=None):
+    """Push ``obj`` on the object stack, returns the stack and its depth
+    to restore when done with ``obj``. ``parent`` is pushed first when
+    the stack is empty."""
+    objs = _object_stack.objs
+    depth = len(objs)
+    if not objs and parent is not None:
+        objs.append(parent)
+    if not objs or objs[-1] is not obj:
+        objs.append(obj)
+    return (objs, depth)
+
+
+def _enter_pack(obj):
+    """Like ``_enter``, and start a pack session if there's none."""
+    started = _object_stack.memo is None
+    if started:
+        _object_stack.memo = _PackMemo()
+    objs, depth = _enter(obj)
+    return (objs, depth, started)
+
+
+def _leave_pack(state):
+    objs, depth, started = state
+    del objs[depth:]
+    if started:
+        _object_stack.memo = None
+
+
+def _call(func, obj, offset=None):
+    if getattr(func, 'contextual', False):
+        return func(obj, _context_for(obj, offset))
+    return func(obj)
+
+
+def _set_parent(obj, parent):
+    if parent is not None and config.PARENT_REFS:
+        parent_ref = obj.parent
+        if parent_ref is None or parent_ref() is not parent:
+            obj.parent = weakref.ref(parent)
+    elif obj.parent is not None:
+        obj.parent = None
+
+
+def vectorized(func):
+    """Mark a validator as checking many values of a field at once.
+
+    It's called with a list of field values, and returns the indexes of
+    the invalid ones. With deferred validation, it gets the values of the
+    field from all the objects unpacked together.
+    """
+    func.vectorized = True
+    return func
+
+
+def _format_path(path):
+    parts = []
+    for p in path:
+        if isinstance(p, int):
+            parts.append('[{}]'.format(p))
+        else:
+            parts.append('.' + p if parts else p)
+    return ''.join(parts)
+
+
+class ValidationError(ValueError):
+    """Failed validators, with the path of each failing field.
+
+    ``errors`` is a list of ``(path, exception)`` pairs, where ``path`` is
+    a tuple of field names and list indexes.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('\n'.join(
+            '{}: {}'.format(_format_path(path), exc) for path, exc in errors))
+
+
+def _invalid_values(bad, values):
+    return [(i, ValueError('Invalid value {}'.format(repr(values[i]))))
+            for i in bad]
+
+
+def _check_now(obj, fval, finfo):
+    validator = finfo.validator
+    if getattr(validator, 'vectorized', False):
+        bad = validator([fval], finfo)
+        if bad:
+            raise ValidationError(
+                [((finfo.name,), exc)
+                 for _i, exc in _invalid_values(bad, [fval])])
+    else:
+        validator(fval, finfo)
+
+
+def _object_paths(root):
+    paths = {}
+    stack = [(root, ())]
+    while stack:
+        obj, path = stack.pop()
+        paths[id(obj)] = path
+        for fname, val in dict.items(obj):
+            if isinstance(val, CompositeStructMixin):
+                stack.append((val, path + (fname,)))
+            elif isinstance(val, list):
+                for i, v in enumerate(val):
+                    if isinstance(v, CompositeStructMixin):
+                        stack.append((v, path + (fname, i)))
+    return paths
+
+
+_VALIDATION_POLICIES = ('eager', 'deferred', 'off')
+
+
+class _Validation:
+    """How validators run in the current unpack, see
+    ``dumpy.config.VALIDATION``."""
+
+    def __init__(self, policy):
+        if policy not in _VALIDATION_POLICIES:
+            raise ValueError(
+                'Unknown validation policy {}'.format(repr(policy)))
+        self.policy = policy
+        self.pending = []
+        # Cached objects to mark as validated if no validator fails
+        self.cached = []
+
+    def check(self, obj, fval, finfo):
+        if self.policy == 'eager':
+            _check_now(obj, fval, finfo)
+        elif self.policy == 'deferred':
+            self.pending.append((obj, fval, finfo))
+
+    def finish(self, root):
+        """Run the deferred validators, raise a ``ValidationError`` for all
+        the failures."""
+        pending, self.pending = self.pending, []
+        cached, self.cached = self.cached, []
+        if not pending:
+            self._mark_validated(cached)
+            return
+
+        errors = []
+        batches = collections.OrderedDict()
+        for obj, fval, finfo in pending:
+            if getattr(finfo.validator, 'vectorized', False):
+                batches.setdefault(id(finfo), []).append((obj, fval, finfo))
+                continue
+            try:
+                finfo.validator(fval, finfo)
+            except Exception as exc:
+                errors.append((obj, finfo, exc))
+
+        for batch in batches.values():
+            finfo = batch[0][2]
+            values = [fval for _obj, fval, _finfo in batch]
+            bad = finfo.validator(values, finfo)
+            if bad:
+                errors.extend((batch[i][0], finfo, exc)
+                              for i, exc in _invalid_values(bad, values))
+
+        if errors:
+            paths = _object_paths(root)
+            raise ValidationError(
+                [(paths.get(id(obj), ()) + (finfo.name,), exc)
+                 for obj, finfo, exc in errors])
+        self._mark_validated(cached)
+
+    @staticmethod
+    def _mark_validated(cached):
+        for obj in cached:
+            obj._validated = True
+
+
+def _begin_validation(policy):
+    """Start validating an unpack, returns None if one is in progress."""
+    if _object_stack.validation is not None:
+        return None
+    session = _Validation(policy or config.VALIDATION)
+    _object_stack.validation = session
+    return session
+
+
+def _validation_policy():
+    session = _object_stack.validation
+    if session is None:
+        return config.VALIDATION
+    return session.policy
+
+
+def _find_byte(buf, byte, start):
+    try:
+        return buf.find(byte, start)
+    except AttributeError:
+        pass
+
+    # memoryview and friends have no find(). Copying the rest of the buffer
+    # each time would make scanning many short strings quadratic, so search
+    # growing chunks instead.
+    view = memoryview(buf).cast('B')
+    end = len(view)
+    chunk = 64
+    while start < end:
+        idx = view[start:start + chunk].tobytes().find(byte)
+        if idx >= 0:
+            return idx + start
+        start += chunk
+        chunk = min(chunk * 2, 64 * 1024)
+    return -1
+
+
+def _unpack_next(ftype, buf, offset, parent):
+    """Unpack a value of any field type, returns it with its end offset."""
+    if issubclass(ftype, CompositeStructMixin):
+        return ftype._unpack_end(buf, offset, parent)
+    v = ftype.unpack_from(buf, offset, parent)
+    return (v, offset + v.size)
+
+
+class Terminator:
+    """Base class for declarative terminator counts.
+
+    A terminator can be used as the count of a field, in place of a boolean
+    count callable. The terminating element is kept in the field value.
+    """
+
+    field_name = None
+
+    def bind(self, fname):
+        term = copy.copy(self)
+        term.field_name = fname
+        return term
+
+    def matches(self, value):
+        raise NotImplementedError
+
+    def __call__(self, obj):
+        val_list = obj._safe_get(self.field_name, [])
+        if len(val_list) <= 0:
+            return True
+        else:
+            return not self.matches(val_list[-1])
+
+    def scan(self, ftype, buf, offset, obj, val_list):
+        while True:
+            v, offset = _unpack_next(ftype, buf, offset, obj)
+            val_list.append(v)
+            if self.matches(v):
+                return offset
+
+    def skip(self, ftype, buf, offset, obj):
+        return self.scan(ftype, buf, offset, obj, [])
+
+    def find(self, ftype, buf, offset, obj):
+        """Returns the offset of the terminating element."""
+        while True:
+            v, end = _unpack_next(ftype, buf, offset, obj)
+            if self.matches(v):
+                return offset
+            offset = end
+
+
+class ByteTerminator(Terminator):
+    def __init__(self, value):
+        self.value = value
+        self._byte = bytes([value])
+
+    def matches(self, value):
+        return value == self.value
+
+    def scan(self, ftype, buf, offset, obj, val_list):
+        if not (issubclass(ftype, PrimitiveStructMixin) and
+                ftype.__struct__.size == 1):
+            return super().scan(ftype, buf, offset, obj, val_list)
+
+        idx = _find_byte(buf, self._byte, offset)
+        if idx < 0:
+            raise ValueError(
+                'Terminator {} not found for field {}'.format(
+                    repr(self._byte), repr(self.field_name)))
+        end = idx + 1
+        val_list.extend(ftype.unpack_many(buf, offset, end - offset))
+        return end
+
+    def skip(self, ftype, buf, offset, obj):
+        if not (issubclass(ftype, PrimitiveStructMixin) and
+                ftype.__struct__.size == 1):
+            return super().skip(ftype, buf, offset, obj)
+
+        idx = _find_byte(buf, self._byte, offset)
+        if idx < 0:
+            raise ValueError(
+                'Terminator {} not found for field {}'.format(
+                    repr(self._byte), repr(self.field_name)))
+        return idx + 1
+
+    def find(self, ftype, buf, offset, obj):
+        if not (issubclass(ftype, PrimitiveStructMixin) and
+                ftype.__struct__.size == 1):
+            return super().find(ftype, buf, offset, obj)
+
+        idx = _find_byte(buf, self._byte, offset)
+        if idx < 0:
+            raise ValueError(
+                'Terminator {} not found for field {}'.format(
+                    repr(self._byte), repr(self.field_name)))
+        return idx
+
+
+class FieldTerminator(Terminator):
+    def __init__(self, name, value):
+        self.name = name
+        if isinstance(value, (bytes, bytearray)):
+            value = list(value)
+        self.value = value
+
+    def matches(self, value):
+        return value._safe_get(self.name) == self.value
+
+    def skip(self, ftype, buf, offset, obj):
+        need = frozenset([self.name])
+        while True:
+            v, offset = ftype._skip_from(buf, offset, obj, need)
+            if self.matches(v):
+                return offset
+
+    def find(self, ftype, buf, offset, obj):
+        need = frozenset([self.name])
+        while True:
+            v, end = ftype._skip_from(buf, offset, obj, need)
+            if self.matches(v):
+                return offset
+            offset = end
+
+
+class EOFTerminator(Terminator):
+    def matches(self, value):
+        return False
+
+    def __call__(self, obj):
+        raise TypeError(
+            'Field {} is terminated by the end of the buffer'.format(
+                repr(self.field_name)))
+
+    def scan(self, ftype, buf, offset, obj, val_list):
+        end = len(buf)
+        if issubclass(ftype, PrimitiveStructMixin):
+            elem_size = ftype.__struct__.size
+            count = (end - offset) // elem_size
+            val_list.extend(ftype.unpack_many(buf, offset, count))
+            return offset + count * elem_size
+
+        while offset < end:
+            v, offset = _unpack_next(ftype, buf, offset, obj)
+            val_list.append(v)
+        return offset
+
+    def skip(self, ftype, buf, offset, obj):
+        end = len(buf)
+        elem_size = _fixed_size_of(ftype)
+        if elem_size is not None:
+            return offset + (end - offset) // elem_size * elem_size
+
+        while offset < end:
+            _v, offset = ftype._skip_from(buf, offset, obj)
+        return offset
+
+    def find(self, ftype, buf, offset, obj):
+        # There's no terminating element, new ones go to the end
+        return self.skip(ftype, buf, offset, obj)
+
+
+def until_byte(value):
+    return ByteTerminator(value)
+
+
+def until_field(name, value):
+    return FieldTerminator(name, value)
+
+
+def until_eof():
+    return EOFTerminator()
+
+
+BitInfo = collections.namedtuple('BitInfo', ['group', 'shift', 'mask'])
+
+
+class BitGroup:
+    """A group of sub-byte fields sharing one primitive storage word.
+
+    The first member occupies the most significant bits. Calling the group
+    with a composite object composes the storage word from the member
+    values, so the group acts as the computed default of its own field.
+    """
+
+    def __init__(self, name, tp, members):
+        if not (issubclass(tp, PrimitiveStructMixin) and issubclass(tp, int)):
+            raise TypeError(
+                'Bit group {} needs an integer storage type'.format(
+                    repr(name)))
+
+        self.name = name
+        self.tp = tp
+        self.members = []
+
+        fmt = tp.__struct__.format
+        if isinstance(fmt, bytes):
+            fmt = fmt.decode()
+        # Words of signed storage types are stored in two's complement
+        self._sign_bit = 0
+        if fmt[-1].islower():
+            self._sign_bit = 1 << (tp.__struct__.size * 8 - 1)
+
+        shift = tp.__struct__.size * 8
+        for m in members:
+            mname, width, default, validator = bit(*m)
+            shift -= width
+            if width <= 0 or shift < 0:
+                raise ValueError(
+                    'Bit group {} does not fit in {} bits'.format(
+                        repr(name), tp.__struct__.size * 8))
+            self.members.append(
+                FieldInfo(mname, BitInfo(self, shift, (1 << width) - 1),
+                          1, default, validator))
+        if shift != 0:
+            raise ValueError(
+                'Bit group {} leaves {} bits unused'.format(
+                    repr(name), shift))
+
+    def __call__(self, obj):
+        word = 0
+        for m in self.members:
+            word |= (obj[m.name] & m.tp.mask) << m.tp.shift
+        if word & self._sign_bit:
+            word -= self._sign_bit << 1
+        return self.tp.from_value(word)
+
+
+def bit(name, width, default=0, validator=None):
+    return (name, width, default, validator)
+
+
+def bits(name, tp, *members):
+    return BitGroup(name, tp, members)
+
+
 class VariableType:
-    def __init__(self, get_type):
+    def __init__(self, get_type, depends=None):
         self._get_type = get_type
+        if depends is None:
+            depends = getattr(get_type, 'depends', None)
+        self.depends = depends
+
+    def get_type(self, obj, offset=None):
+        return _call(self._get_type, obj, offset)
+
+
+class Compressed:
+    """Base class for the field types made by ``compressed``.
+
+    Values keep the compressed bytes they were unpacked from. The payload is
+    only decompressed when ``data`` or ``value`` is read, and only
+    recompressed when packing if it was modified.
+    """
+
+    # The type of the decompressed payload, or None for plain bytes
+    __inner__ = None
+    # Anything with zlib-style compress(), decompress() and, for streaming,
+    # decompressobj()
+    __codec__ = zlib
+    # Compressed size, a callable as for field counts, or None to read to
+    # the end of the buffer
+    __length__ = None
+
+    def __init__(self, raw=b''):
+        self._raw = raw
+        self._data = None
+        self._value = None
+
+    @classmethod
+    def from_value(cls, value):
+        if isinstance(value, cls):
+            return value
+        obj = cls(None)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            obj.data = value
+        else:
+            obj.value = value
+        return obj
+
+    def _sync(self):
+        if self._value is not None:
+            # The inner object may have been modified in place
+            data = self._value.pack()
+            if data != self._data:
+                self._data = data
+                self._raw = None
+
+    @property
+    def data(self):
+        """The decompressed payload."""
+        self._sync()
+        if self._data is None:
+            self._data = self.__codec__.decompress(self._raw)
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = bytes(data)
+        self._value = None
+        self._raw = None
+
+    def _check_inner(self):
+        if self.__inner__ is None:
+            raise TypeError(
+                '{} has no inner type'.format(type(self).__name__))
+
+    @property
+    def value(self):
+        """The payload decoded as ``__inner__``."""
+        self._check_inner()
+        if self._value is None:
+            self._value = self.__inner__.unpack(self.data)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._check_inner()
+        if not isinstance(value, self.__inner__):
+            value = self.__inner__(value)
+        self._value = value
+        self._data = None
+        self._raw = None
+
+    @property
+    def raw(self):
+        """The compressed payload."""
+        self._sync()
+        if self._raw is None:
+            self._raw = self.__codec__.compress(self._data)
+        return self._raw
+
+    def iter_data(self, chunk_size=64 * 1024):
+        """Decompress the payload piece by piece, without keeping it."""
+        decompressobj = getattr(self.__codec__, 'decompressobj', None)
+        self._sync()
+        if self._data is not None or decompressobj is None:
+            yield self.data
+            return
+
+        d = decompressobj()
+        raw = memoryview(self._raw)
+        for i in range(0, len(raw), chunk_size):
+            piece = d.decompress(raw[i:i + chunk_size])
+            if piece:
+                yield piece
+        piece = d.flush()
+        if piece:
+            yield piece
+
+    def pack(self):
+        return bytes(self.raw)
+
+    def pack_into(self, buf, offset=0):
+        raw = self.raw
+        buf[offset:offset + len(raw)] = raw
+
+    @property
+    def size(self):
+        return len(self.raw)
+
+    @classmethod
+    def _end(cls, buf, offset, parent):
+        length = cls.__length__
+        if length is None:
+            return len(buf)
+        if callable(length):
+            length = _call(length, parent, offset)
+        end = offset + length
+        if end > len(buf):
+            raise ValueError(
+                'Expected {} compressed bytes, but only got {}'.format(
+                    length, len(buf) - offset))
+        return end
+
+    @classmethod
+    def unpack(cls, buf):
+        return cls.unpack_from(buf, 0)
+
+    @classmethod
+    def unpack_from(cls, buf, offset=0, parent=None):
+        return cls(bytes(buf[offset:cls._end(buf, offset, parent)]))
+
+    @classmethod
+    def _skip_from(cls, buf, offset, parent,
+                   need=frozenset(), partial=False):
+        return (None, cls._end(buf, offset, parent))
+
+    def __eq__(self, other):
+        if not isinstance(other, Compressed):
+            return NotImplemented
+        return self.data == other.data
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<{} {} compressed bytes>'.format(
+            type(self).__name__, len(self.raw))
+
+
+def compressed(inner=None, codec=zlib, length=None):
+    """Make a field type for a compressed payload.
+
+    ``inner`` is the type of the decompressed data, or ``None`` to handle
+    it as bytes. ``length`` is the compressed size, either a number or a
+    callable taking the enclosing object, as for field counts.
+    """
+    name = 'Compressed' + getattr(inner, '__name__', '')
+    return type(name, (Compressed,), {
+        '__inner__': inner,
+        '__codec__': codec,
+        '__length__': length,
+    })
+
+
+def _add_iov(iov, data, min_size):
+    if len(data) >= min_size:
+        iov.append(memoryview(data))
+    elif iov and isinstance(iov[-1], bytearray):
+        iov[-1] += data
+    else:
+        iov.append(bytearray(data))
+
+
+class FrozenList(list):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('Frozen list cannot be modified')
 
-    def get_type(self, obj):
-        return self._get_type(obj)
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = _readonly
+    sort = reverse = _readonly
+
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize'])
+
+
+class ParseCache:
+    """A bounded LRU mapping from raw byte spans to frozen objects."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, check=None):
+        """Returns the cached object, or None. Objects failing ``check``
+        are counted as misses."""
+        try:
+            obj = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if check is not None and not check(obj):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return obj
+
+    def put(self, key, obj):
+        self._entries[key] = obj
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         self.maxsize, len(self._entries))
+
+
+def _rebuild(cls, items):
+    """Reconstruct an object copied or pickled by ``__reduce_ex__``."""
+    obj = cls()
+    super(CompositeStructMixin, obj).update(items)
+    for val in obj.values():
+        vals = val if isinstance(val, list) else (val,)
+        for v in vals:
+            # Shallow copies share their sub-objects with the original
+            if isinstance(v, CompositeStructMixin) and v.parent is None:
+                _set_parent(v, obj)
+    return obj
 
 
 class CompositeStructMixin:
+    _frozen = False
+    # A weakref to the enclosing object, see ``dumpy.config.PARENT_REFS``
+    parent = None
+    # Set by unpack_from and peek
+    offset = None
+    _spans = None
+    # The packed bytes of a frozen object, see ``freeze``
+    _packed = None
+    # Whether the object waits in its class pool, see ``release``
+    _pooled = False
+    # Whether the validators ran on a cached object, see ``_unpack_cached``
+    _validated = False
+
+    def _check_mutable(self):
+        if self._frozen:
+            raise TypeError(
+                '{} object is frozen'.format(type(self).__name__))
+
     def _safe_get(self, fname, default=None):
         try:
             return super().__getitem__(fname)
         except KeyError:
             return default
 
+    def _computed(self, fname, default, count=None):
+        """Call a default callable, or ``count`` times for a list, reusing
+        the values computed earlier in the same pack."""
+        memo = _object_stack.memo
+        if memo is not None:
+            key = (id(self), fname)
+            try:
+                return memo.defaults[key]
+            except KeyError:
+                pass
+
+        if count is None:
+            value = _call(default, self)
+        else:
+            value = [_call(default, self) for _i in range(count)]
+
+        if memo is not None:
+            memo.objs[id(self)] = self
+            memo.defaults[key] = value
+        return value
+
     def _get_field(self, fname, count, default):
         if callable(count):
             # variable length
@@ -103,11 +978,12 @@ class CompositeStructMixin:
                             'Expected {} values for field {}, '
                             'but got {}'.format(count, repr(fname), real_count))
                     elif callable(default):
-                        default_list = \
-                            [default(self) for _i in range(count - real_count)]
+                        default_list = self._computed(
+                            fname, default, count - real_count)
                     else:
                         default_list = [default] * (count - real_count)
-                    val_list += default_list
+                    # The stored list may be frozen, don't extend it
+                    val_list = val_list + default_list
                 elif real_count > count:
                     # We checked this in __setitem__ too, but lists are mutable,
                     # so we check again here, just to be sure.
@@ -122,23 +998,32 @@ class CompositeStructMixin:
                     field_val = self._safe_get(fname, None)
                     if field_val is None:
                         if callable(default):
-                            default = default(self)
+                            default = self._computed(fname, default)
                         field_val = default
                 return field_val
             else:
                 return None
 
-    def _normalize_composite(self, value, ftype):
+    def _normalize_composite(self, value, ftype, intern=False):
         if issubclass(ftype, CompositeStructMixin):
             if not isinstance(value, ftype):
                 value = ftype(value)
-            value.parent = weakref.ref(self)
+            if not value._frozen:
+                # Frozen objects may be shared by many parents
+                _set_parent(value, self)
+        elif intern and issubclass(ftype, PrimitiveStructMixin):
+            value = ftype.from_value(value)
         return value
 
     @classmethod
-    def _validate(cls, fval, finfo):
-        if finfo.validator is not None:
-            finfo.validator(fval, finfo)
+    def _validate(cls, fval, finfo, obj=None):
+        if finfo.validator is None:
+            return
+        session = _object_stack.validation
+        if session is None:
+            _check_now(obj, fval, finfo)
+        else:
+            session.check(obj, fval, finfo)
 
     def __getitem__(self, fname):
         finfo = self.__field_info__[fname]
@@ -147,47 +1032,210 @@ class CompositeStructMixin:
             raise ValueError('Field {} cannot be read'.format(fname))
         return ret
 
+    def _set_bits(self, group, word, validate=False):
+        word = int(word)
+        for m in group.members:
+            mval = (word >> m.tp.shift) & m.tp.mask
+            if validate:
+                self._validate(mval, m, self)
+            super().__setitem__(m.name, mval)
+
+    @staticmethod
+    def _check_count(fname, finfo, value):
+        if not isinstance(value, abc.Sequence):
+            raise TypeError(
+                'Field {} needs a sequence'.format(repr(fname)))
+        if len(value) > finfo.count:
+            raise ValueError(
+                'Field {} needs {} values, but got {}'.format(
+                    repr(fname), finfo.count, len(value)))
+        elif len(value) < finfo.count and finfo.default is NoDefault:
+            raise ValueError(
+                'Field {} needs {} values, but got {}'.format(
+                    repr(fname), finfo.count, len(value)))
+
     def __setitem__(self, fname, value):
+        self._check_mutable()
         finfo = self.__field_info__[fname]
 
+        if isinstance(finfo.tp, BitInfo):
+            if isinstance(value, abc.Sequence):
+                raise TypeError(
+                    'Field {} cannot accept a sequence'.format(repr(fname)))
+            if not 0 <= value <= finfo.tp.mask:
+                raise ValueError(
+                    'Field {} needs a value between 0 and {}, '
+                    'but got {}'.format(repr(fname), finfo.tp.mask, value))
+            super().__setitem__(fname, int(value))
+            return
+        elif isinstance(finfo.default, BitGroup):
+            if isinstance(value, abc.Sequence):
+                raise TypeError(
+                    'Field {} cannot accept a sequence'.format(repr(fname)))
+            self._set_bits(finfo.default, value)
+            return
+
+        # Primitive values of variable types are converted when packing,
+        # since the type may still change.
         if isinstance(finfo.tp, VariableType):
             ftype = finfo.tp.get_type(self)
+            intern = False
         else:
             ftype = finfo.tp
+            intern = True
+
+        # Counts are checked again when packing, so these checks can be
+        # turned off, see ``dumpy.config.VALIDATION``
+        checked = _validation_policy() == 'eager'
 
         if callable(finfo.count):
-            if not isinstance(value, abc.Sequence):
+            if checked and not isinstance(value, abc.Sequence):
                 raise TypeError(
                     'Field {} needs a sequence'.format(repr(fname)))
-            value = [self._normalize_composite(v, ftype) for v in value]
+            value = [self._normalize_composite(v, ftype, intern)
+                     for v in value]
             super().__setitem__(fname, value)
         else:
             if finfo.count > 1:
-                if not isinstance(value, abc.Sequence):
-                    raise TypeError(
-                        'Field {} needs a sequence'.format(repr(fname)))
-                if len(value) > finfo.count:
-                    raise ValueError(
-                        'Field {} needs {} values, but got {}'.format(
-                            repr(fname), finfo.count, len(value)))
-                elif len(value) < finfo.count and finfo.default is NoDefault:
-                    raise ValueError(
-                        'Field {} needs {} values, but got {}'.format(
-                            repr(fname), finfo.count, len(value)))
-
-                value = [self._normalize_composite(v, ftype) for v in value]
+                if checked:
+                    self._check_count(fname, finfo, value)
+                value = [self._normalize_composite(v, ftype, intern)
+                         for v in value]
                 super().__setitem__(fname, value)
             elif finfo.count == 1:
-                if isinstance(value, abc.Sequence):
+                if issubclass(ftype, Compressed):
+                    # Takes compressed values, payloads or inner objects
+                    super().__setitem__(fname, ftype.from_value(value))
+                    return
+                if checked and isinstance(value, abc.Sequence):
                     raise TypeError(
                         'Field {} cannot accept a sequence'.format(repr(fname)))
 
-                value = self._normalize_composite(value, ftype)
+                value = self._normalize_composite(value, ftype, intern)
                 super().__setitem__(fname, value)
             else:
                 raise ValueError('No space for field {}'.format(repr(fname)))
 
     def pack(self):
+        if self._frozen:
+            packed = self._packed
+            if packed is None:
+                packed = self._packed = self._pack()
+            return packed
+        return self._pack()
+
+    def _pack(self):
+        state = _enter_pack(self)
+        try:
+            backend = _backend_for(type(self))
+            backend.prepare(self)
+            return backend.pack(self)
+        finally:
+            _leave_pack(state)
+
+    def pack_into(self, buf, offset=0):
+        if self._frozen:
+            packed = self.pack()
+            if len(buf) - offset < len(packed):
+                raise ValueError(
+                    'pack_into needs {} bytes of space, but only got {}'.format(
+                        len(packed), len(buf) - offset))
+            buf[offset:offset + len(packed)] = packed
+            return
+
+        state = _enter_pack(self)
+        try:
+            backend = _backend_for(type(self))
+            backend.prepare(self)
+            backend.pack_into(self, buf, offset)
+        finally:
+            _leave_pack(state)
+
+    def pack_iov(self, min_size=1024):
+        """Pack the object into a list of buffers.
+
+        Payloads of at least ``min_size`` bytes get buffers of their own,
+        compressed payloads are referenced without copying, and the small
+        fields in between are coalesced into ``bytearray`` objects. The
+        list can be passed to ``os.writev`` or ``socket.sendmsg``.
+        """
+        iov = []
+        self._pack_iov(iov, min_size)
+        return iov
+
+    def _pack_iov(self, iov, min_size):
+        if self._frozen:
+            _add_iov(iov, self.pack(), min_size)
+            return
+
+        state = _enter_pack(self)
+        try:
+            self._resolve_defaults()
+            for fname in self.__fields__:
+                finfo = self.__field_info__[fname]
+                val = self._get_field(fname, finfo.count, finfo.default)
+
+                if val is None:
+                    continue
+
+                if isinstance(finfo.tp, VariableType):
+                    ftype = finfo.tp.get_type(self)
+                else:
+                    ftype = finfo.tp
+
+                if isinstance(val, list) and \
+                        issubclass(ftype, PrimitiveStructMixin):
+                    _add_iov(iov, ftype.pack_many(val), min_size)
+                    continue
+
+                if not isinstance(val, list):
+                    val = [val]
+                for v in val:
+                    if isinstance(v, Compressed):
+                        _add_iov(iov, v.raw, min_size)
+                    elif isinstance(v, CompositeStructMixin) and \
+                            type(v).__fixed_size__ is None:
+                        v._pack_iov(iov, min_size)
+                    elif hasattr(v, 'pack'):
+                        _add_iov(iov, v.pack(), min_size)
+                    else:
+                        _add_iov(iov, ftype.from_value(v).pack(), min_size)
+        finally:
+            _leave_pack(state)
+
+    @property
+    def size(self):
+        if self._packed is not None:
+            return len(self._packed)
+
+        state = _enter_pack(self)
+        try:
+            sizes = _object_stack.memo.sizes
+            size = sizes.get(id(self))
+            if size is None:
+                backend = _backend_for(type(self))
+                backend.prepare(self)
+                size = backend.size(self)
+                sizes[id(self)] = size
+            return size
+        finally:
+            _leave_pack(state)
+
+    def _resolve_defaults(self):
+        """Evaluate the computed defaults, in dependency order.
+
+        Only done once per pack, and the values are shared by ``size`` and
+        the packing itself.
+        """
+        memo = _object_stack.memo
+        if id(self) in memo.objs:
+            return
+        memo.objs[id(self)] = self
+        for fname in self.__computed__:
+            finfo = self.__field_info__[fname]
+            self._get_field(fname, finfo.count, finfo.default)
+
+    def _ref_pack(self):
         bin_list = []
         for fname in self.__fields__:
             finfo = self.__field_info__[fname]
@@ -206,14 +1254,14 @@ class CompositeStructMixin:
                         ftype = finfo.tp.get_type(self)
                     else:
                         ftype = finfo.tp
-                    packed = ftype(v).pack()
+                    packed = ftype.from_value(v).pack()
                 bin_list.append(packed)
 
         return b''.join(bin_list)
 
-    def pack_into(self, buf, offset=0):
+    def _ref_pack_into(self, buf, offset):
         total_size = self.size
-        if len(buf[offset:]) < total_size:
+        if len(buf) - offset < total_size:
             raise ValueError(
                 'pack_into needs {} bytes of space, but only got {}'.format(
                     total_size, len(buf[offset:])))
@@ -235,95 +1283,759 @@ class CompositeStructMixin:
                         ftype = finfo.tp.get_type(self)
                     else:
                         ftype = finfo.tp
-                    v = ftype(v)
+                    v = ftype.from_value(v)
                     v.pack_into(buf, offset)
                 offset += v.size
 
     @classmethod
-    def unpack(cls, buf):
-        obj = cls.unpack_from(buf, 0)
+    def unpack(cls, buf, validation=None):
+        obj = cls.unpack_from(buf, 0, validation=validation)
+        return obj
+
+    def __delitem__(self, fname):
+        self._check_mutable()
+        super().__delitem__(fname)
+
+    def clear(self):
+        self._check_mutable()
+        super().clear()
+
+    def pop(self, *args):
+        self._check_mutable()
+        return super().pop(*args)
+
+    def popitem(self):
+        self._check_mutable()
+        return super().popitem()
+
+    def setdefault(self, *args):
+        self._check_mutable()
+        return super().setdefault(*args)
+
+    def update(self, *args, **kwargs):
+        self._check_mutable()
+        super().update(*args, **kwargs)
+
+    def freeze(self):
+        """Make this object and all its sub-objects read-only.
+
+        Frozen objects pack themselves only once, and are hashable. They
+        compare equal to other frozen objects of the same class when their
+        packed bytes are equal. Copies made with ``copy.deepcopy`` or
+        ``pickle`` are mutable.
+        """
+        if self._frozen:
+            return self
+
+        for fname, val in self.items():
+            if isinstance(val, list):
+                for v in val:
+                    if isinstance(v, CompositeStructMixin):
+                        v.freeze()
+                super().__setitem__(fname, FrozenList(val))
+            elif isinstance(val, CompositeStructMixin):
+                val.freeze()
+        self._frozen = True
+        return self
+
+    @classmethod
+    def unpack_frozen(cls, buf, offset=0, parent=None, validation=None):
+        """Unpack a frozen object.
+
+        Its source bytes are kept as its packed bytes, so they don't have
+        to be packed again for ``pack``, hashing or comparisons.
+        """
+        obj, end = cls._unpack_end(buf, offset, parent, validation)
+        if not obj._frozen:
+            obj.freeze()
+            obj._packed = bytes(buf[offset:end])
         return obj
 
+    def validate(self):
+        """Run the validators of this object and all its sub-objects.
+
+        All failures are reported together in a ``ValidationError``.
+        """
+        session = _Validation('deferred')
+        stack = [self]
+        while stack:
+            obj = stack.pop()
+            for fname in obj.__fields__:
+                finfo = obj.__field_info__[fname]
+                if isinstance(finfo.default, BitGroup):
+                    infos = finfo.default.members
+                else:
+                    infos = [finfo]
+
+                for info in infos:
+                    val = obj._safe_get(info.name)
+                    if val is None and info.default is not NoDefault:
+                        val = obj._get_field(info.name, info.count,
+                                             info.default)
+                    if val is None:
+                        continue
+                    if info.validator is not None:
+                        session.check(obj, val, info)
+                    if isinstance(val, CompositeStructMixin):
+                        stack.append(val)
+                    elif isinstance(val, list):
+                        stack.extend(v for v in val
+                                     if isinstance(v, CompositeStructMixin))
+        session.finish(self)
+
+    def __reduce_ex__(self, protocol):
+        # Copies hold the field values only, they are not frozen and don't
+        # belong to any buffer or parent
+        items = [(fname, list(val) if isinstance(val, list) else val)
+                 for fname, val in self.items()]
+        return (_rebuild, (type(self), items))
+
+    def __eq__(self, other):
+        if self._frozen and isinstance(other, CompositeStructMixin) and \
+                other._frozen:
+            if type(self) is not type(other):
+                return False
+            try:
+                return self.pack() == other.pack()
+            except (KeyError, ValueError, TypeError, struct.error):
+                # Incomplete objects can't be packed, compare their fields
+                pass
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        if eq is NotImplemented:
+            return eq
+        return not eq
+
+    def __hash__(self):
+        if not self._frozen:
+            raise TypeError(
+                'unhashable type: {}'.format(repr(type(self).__name__)))
+        return hash(self.pack())
+
     @classmethod
-    def unpack_from(cls, buf, offset=0, parent=None):
+    def enable_parse_cache(cls, maxsize=128):
+        """Cache objects unpacked by this class, keyed by their raw bytes.
+
+        Cached objects are frozen, since they are shared by all callers
+        that unpack the same bytes. The byte span of a variable-size object
+        is found with ``skip``, so decoding must only depend on those bytes.
+        """
+        cls.__parse_cache__ = ParseCache(maxsize)
+
+    @classmethod
+    def disable_parse_cache(cls):
+        cls.__parse_cache__ = None
+
+    @classmethod
+    def parse_cache_info(cls):
+        cache = cls.__dict__.get('__parse_cache__')
+        if cache is None:
+            return None
+        return cache.info()
+
+    @classmethod
+    def unpack_from(cls, buf, offset=0, parent=None, validation=None):
+        """Unpack an object at ``offset`` in ``buf``.
+
+        ``validation`` overrides ``dumpy.config.VALIDATION`` for this call,
+        it's ignored when unpacking sub-objects.
+        """
+        return cls._unpack_end(buf, offset, parent, validation)[0]
+
+    @classmethod
+    def _unpack_end(cls, buf, offset, parent, validation=None):
+        """Like ``unpack_from``, but returns the object with its end
+        offset."""
+        session = _begin_validation(validation)
+        if session is None:
+            return cls._unpack_cached(buf, offset, parent)
+        try:
+            obj, end = cls._unpack_cached(buf, offset, parent)
+            session.finish(obj)
+        finally:
+            _object_stack.validation = None
+        return (obj, end)
+
+    @classmethod
+    def _unpack_cached(cls, buf, offset, parent):
+        cache = cls.__dict__.get('__parse_cache__')
+        if cache is None:
+            return cls._unpack_from(buf, offset, parent)
+
+        if cls.__fixed_size__ is not None:
+            end = offset + cls.__fixed_size__
+        else:
+            _obj, end = cls._skip_from(buf, offset, parent)
+        key = bytes(buf[offset:end])
+        policy = _validation_policy()
+        # Objects decoded without running their validators are decoded
+        # again for callers that want them validated
+        check = None if policy == 'off' else _is_validated
+        obj = cache.get(key, check)
+        if obj is None:
+            obj, _end = cls._unpack_from(buf, offset, None)
+            obj.freeze()
+            # Cached objects are shared, they don't belong to any buffer
+            obj.offset = None
+            obj._packed = key
+            session = _object_stack.validation
+            if policy == 'eager' or not _has_validators(cls):
+                obj._validated = True
+            elif policy == 'deferred' and session is not None:
+                # Deferred validators may still fail
+                session.cached.append(obj)
+            cache.put(key, obj)
+        return (obj, end)
+
+    @classmethod
+    def skip(cls, buf, offset=0):
+        """Find the end offset of an object without fully decoding it.
+
+        Only the fields that drive counts, variable types or terminators
+        are decoded, fixed-size regions are jumped over.
+        """
+        _obj, end = cls._skip_from(buf, offset, None)
+        if end > len(buf):
+            raise ValueError(
+                'Object needs {} bytes, but only got {}'.format(
+                    end - offset, len(buf) - offset))
+        return end
+
+    @classmethod
+    def measure(cls, buf, offset=0):
+        return cls.skip(buf, offset) - offset
+
+    @classmethod
+    def peek(cls, buf, offset=0, fields=()):
+        """Partially unpack an object.
+
+        Only the fields named in ``fields`` and those needed by ``skip``
+        are decoded, but ``field_span`` works for all of them.
+        """
+        obj, _end = cls._skip_from(
+            buf, offset, None, frozenset(fields), partial=True)
+        return obj
+
+    @classmethod
+    def offset_of(cls, fname):
+        """Returns the offset of a field from the start of the object.
+
+        Only fields up to the first dynamically sized one have a static
+        offset, a ``ValueError`` is raised for the others.
+        """
+        cls.__field_info__[fname]
+        try:
+            return cls.__offsets__[fname]
+        except KeyError:
+            raise ValueError(
+                'Field {} does not have a static offset'.format(repr(fname)))
+
+    @classmethod
+    def terminator_offset(cls, fname, buf, offset=0):
+        """Returns where the terminating element of a field starts.
+
+        This is where new elements should go, to append to a terminated
+        list in place. Only the fields needed to get there are decoded.
+        """
+        finfo = cls.__field_info__[fname]
+        if not isinstance(finfo.count, Terminator):
+            raise ValueError(
+                'Field {} does not have a terminator'.format(repr(fname)))
+
         obj = cls()
+        obj.offset = offset
+        obj._spans = {}
 
-        if parent is not None:
-            obj.parent = weakref.ref(parent)
+        objs, depth = _enter(obj)
+        try:
+            obj, start = cls._skip_fields(
+                obj, buf, offset, frozenset(), False, stop=fname)
+            if isinstance(finfo.tp, VariableType):
+                ftype = finfo.tp.get_type(obj, start)
+            else:
+                ftype = finfo.tp
+            return finfo.count.find(ftype, buf, start, obj)
+        finally:
+            del objs[depth:]
+
+    @classmethod
+    def _skip_from(cls, buf, offset, parent,
+                   need=frozenset(), partial=False):
+        """Returns a partially decoded object and its end offset."""
+        if not (need or partial) and cls.__fixed_size__ is not None:
+            return (None, offset + cls.__fixed_size__)
+
+        obj = cls()
+        _set_parent(obj, parent)
+        obj.offset = offset
+        obj._spans = {}
+
+        objs, depth = _enter(obj, parent)
+        try:
+            return cls._skip_fields(obj, buf, offset, need, partial)
+        finally:
+            del objs[depth:]
+
+    @classmethod
+    def _skip_fields(cls, obj, buf, offset, need, partial, stop=None):
+        needed = cls.__skip_needed__
+        if need:
+            needed = needed | need
+
+        skipped = []
+        for fname in cls.__fields__:
+            if fname == stop:
+                break
+            finfo = cls.__field_info__[fname]
+
+            if isinstance(finfo.tp, VariableType):
+                ftype = finfo.tp.get_type(obj, offset)
+            else:
+                ftype = finfo.tp
+
+            if skipped and _reads_parent(ftype):
+                # Its objects may read any of the fields skipped so far
+                # through their ParseContext
+                for f in skipped:
+                    cls._skip_field(obj, f, buf, obj._spans[f][0], True)
+                skipped = []
+
+            end, decoded = cls._skip_field(
+                obj, fname, buf, offset, fname in needed, ftype)
+            if not decoded:
+                skipped.append(fname)
+            obj._spans[fname] = (offset, end - offset)
+            offset = end
+
+        return (obj, offset)
+
+    @classmethod
+    def _skip_field(cls, obj, fname, buf, offset, decode, ftype=None):
+        """Decode or jump over a field, returns its end offset and whether
+        it was decoded."""
+        finfo = cls.__field_info__[fname]
+        if ftype is None:
+            if isinstance(finfo.tp, VariableType):
+                ftype = finfo.tp.get_type(obj, offset)
+            else:
+                ftype = finfo.tp
+
+        if isinstance(finfo.count, Terminator):
+            if not decode:
+                return (finfo.count.skip(ftype, buf, offset, obj), False)
+            val_list = []
+            super().__setitem__(obj, fname, val_list)
+            return (finfo.count.scan(ftype, buf, offset, obj, val_list), True)
+
+        if callable(finfo.count):
+            real_count = _call(finfo.count, obj, offset)
         else:
-            obj.parent = None
+            real_count = finfo.count
+
+        if isinstance(real_count, bool):
+            # The count callable inspects the decoded elements
+            val_list = []
+            super().__setitem__(obj, fname, val_list)
+            while _call(finfo.count, obj, offset):
+                v, offset = _unpack_next(ftype, buf, offset, obj)
+                val_list.append(v)
+            return (offset, True)
+
+        if decode or (real_count == 1 and not callable(finfo.count) and
+                      issubclass(ftype, PrimitiveStructMixin)):
+            val_list = []
+            for i in range(real_count):
+                v, offset = _unpack_next(ftype, buf, offset, obj)
+                val_list.append(v)
+            if callable(finfo.count) or real_count > 1:
+                super().__setitem__(obj, fname, val_list)
+            elif real_count == 1:
+                if isinstance(finfo.default, BitGroup):
+                    obj._set_bits(finfo.default, val_list[0])
+                else:
+                    super().__setitem__(obj, fname, val_list[0])
+            return (offset, True)
+
+        elem_size = _fixed_size_of(ftype)
+        if elem_size is not None:
+            offset += elem_size * real_count
+        else:
+            for i in range(real_count):
+                _v, offset = ftype._skip_from(buf, offset, obj)
+        return (offset, False)
+
+    @classmethod
+    def enable_pool(cls, maxsize=64):
+        """Keep up to ``maxsize`` released objects for reuse by unpack_from."""
+        cls.__pool__ = collections.deque(maxlen=maxsize)
+
+    @classmethod
+    def disable_pool(cls):
+        cls.__pool__ = None
+
+    @classmethod
+    def _acquire(cls):
+        pool = cls.__dict__.get('__pool__')
+        if pool:
+            obj = pool.pop()
+            obj._pooled = False
+            return obj
+        return cls()
+
+    def release(self):
+        """Hand this object back to its class pool.
+
+        The object, together with its sub-objects, will be overwritten by a
+        later unpack_from, so it must not be used after being released.
+        Releasing it again before it's reused does nothing.
+        """
+        pool = type(self).__dict__.get('__pool__')
+        if pool is not None and not (self._frozen or self._pooled):
+            self._spans = None
+            self._pooled = True
+            pool.append(self)
+
+    @staticmethod
+    def _release_all(values):
+        for v in values:
+            if isinstance(v, CompositeStructMixin):
+                v.release()
+
+    @classmethod
+    def _unpack_reuse(cls, ftype, old, buf, offset, parent):
+        if isinstance(old, CompositeStructMixin):
+            if type(old) is ftype and not old._frozen:
+                return ftype._unpack_into(old, buf, offset, parent)
+            old.release()
+        return _unpack_next(ftype, buf, offset, parent)
+
+    @classmethod
+    def unpack_into(cls, obj, buf, offset=0, parent=None, validation=None):
+        """Unpack into an existing object, reusing its lists and sub-objects."""
+        if not isinstance(obj, cls):
+            raise TypeError(
+                'Expected a {} object, but got {}'.format(
+                    cls.__name__, type(obj).__name__))
+        obj._check_mutable()
+
+        session = _begin_validation(validation)
+        if session is None:
+            return cls._unpack_into(obj, buf, offset, parent)[0]
+        try:
+            cls._unpack_into(obj, buf, offset, parent)
+            session.finish(obj)
+        finally:
+            _object_stack.validation = None
+        return obj
+
+    @classmethod
+    def _unpack_from(cls, buf, offset, parent):
+        return cls._unpack_into(cls._acquire(), buf, offset, parent)
+
+    @classmethod
+    def _unpack_into(cls, obj, buf, offset, parent):
+        """Returns the object and its end offset."""
+        objs, depth = _enter(obj, parent)
+        try:
+            return _backend_for(cls).unpack_into(
+                cls, obj, buf, offset, parent)
+        finally:
+            del objs[depth:]
+
+    @classmethod
+    def _ref_unpack_into(cls, obj, buf, offset, parent):
+        obj.offset = offset
+        _set_parent(obj, parent)
 
         for fname in cls.__fields__:
             finfo = cls.__field_info__[fname]
 
+            if callable(finfo.count) or finfo.count > 1:
+                val_list = obj._safe_get(fname)
+                if type(val_list) is not list:
+                    val_list = []
+
+            if isinstance(finfo.count, Terminator):
+                if isinstance(finfo.tp, VariableType):
+                    ftype = finfo.tp.get_type(obj, offset)
+                else:
+                    ftype = finfo.tp
+                # Sub-objects are not reused, since the count is unknown
+                cls._release_all(val_list)
+                val_list.clear()
+                super().__setitem__(obj, fname, val_list)
+                offset = finfo.count.scan(ftype, buf, offset, obj, val_list)
+                cls._validate(val_list, finfo, obj)
+                continue
+
             count_known = True
             if callable(finfo.count):
-                real_count = finfo.count(obj)
+                real_count = _call(finfo.count, obj, offset)
                 if isinstance(real_count, bool):
                     count_known = False
             else:
                 real_count = finfo.count
 
             if isinstance(finfo.tp, VariableType):
-                ftype = finfo.tp.get_type(obj)
+                ftype = finfo.tp.get_type(obj, offset)
             else:
                 ftype = finfo.tp
 
             if count_known:
-                val_list = []
-                for i in range(real_count):
-                    v = ftype.unpack_from(buf, offset, obj)
-                    offset += v.size
-                    val_list.append(v)
-
-                if callable(finfo.count):
-                    cls._validate(val_list, finfo)
+                if callable(finfo.count) or real_count > 1:
+                    old_count = len(val_list)
+                    for i in range(real_count):
+                        if i < old_count:
+                            v, offset = cls._unpack_reuse(
+                                ftype, val_list[i], buf, offset, obj)
+                            val_list[i] = v
+                        else:
+                            v, offset = _unpack_next(ftype, buf, offset, obj)
+                            val_list.append(v)
+                    cls._release_all(val_list[real_count:])
+                    del val_list[real_count:]
+
+                    cls._validate(val_list, finfo, obj)
                     super().__setitem__(obj, fname, val_list)
-                else:
-                    if len(val_list) > 1:
-                        cls._validate(val_list, finfo)
-                        super().__setitem__(obj, fname, val_list)
-                    elif len(val_list) == 1:
-                        cls._validate(val_list[0], finfo)
-                        super().__setitem__(obj, fname, val_list[0])
+                elif real_count == 1:
+                    v, offset = cls._unpack_reuse(
+                        ftype, obj._safe_get(fname), buf, offset, obj)
+
+                    cls._validate(v, finfo, obj)
+                    if isinstance(finfo.default, BitGroup):
+                        obj._set_bits(finfo.default, v, True)
+                    else:
+                        super().__setitem__(obj, fname, v)
             else:
-                val_list = []
+                cls._release_all(val_list)
+                val_list.clear()
                 super().__setitem__(obj, fname, val_list)
-                while finfo.count(obj):
-                    v = ftype.unpack_from(buf, offset, obj)
-                    offset += v.size
+                while _call(finfo.count, obj, offset):
+                    v, offset = _unpack_next(ftype, buf, offset, obj)
                     val_list.append(v)
-                cls._validate(val_list, finfo)
+                cls._validate(val_list, finfo, obj)
 
-        return obj
+        return (obj, offset)
 
     def _safe_size(self, v, ftype):
         try:
             return v.size
         except AttributeError:
-            return ftype(v).size
+            return ftype.from_value(v).size
 
-    @property
-    def size(self):
+    def _field_size(self, fname, finfo):
+        val = self._get_field(fname, finfo.count, finfo.default)
+
+        if val is None:
+            return 0
+
+        if isinstance(finfo.tp, VariableType):
+            ftype = finfo.tp.get_type(self)
+        else:
+            ftype = finfo.tp
+
+        if isinstance(val, list):
+            size = 0
+            for v in val:
+                size += self._safe_size(v, ftype)
+            return size
+        else:
+            return self._safe_size(val, ftype)
+
+    def _ref_size(self):
         size = 0
         for fname in self.__fields__:
-            finfo = self.__field_info__[fname]
-            val = self._get_field(fname, finfo.count, finfo.default)
+            size += self._field_size(fname, self.__field_info__[fname])
+        return size
 
-            if val is None:
-                continue
+    def field_span(self, fname):
+        """Returns the ``(offset, length)`` of a field's packed bytes.
 
-            if isinstance(finfo.tp, VariableType):
-                ftype = finfo.tp.get_type(self)
-            else:
-                ftype = finfo.tp
+        For unpacked objects, the offset is relative to the buffer they
+        were unpacked from, otherwise it's relative to the packed object.
+        Bit fields report the span of their whole storage word.
+        """
+        finfo = self.__field_info__[fname]
+        if isinstance(finfo.tp, BitInfo):
+            fname = finfo.tp.group.name
+
+        if self._spans is not None:
+            return self._spans[fname]
+
+        offset = self.offset or 0
+        for f in self.__fields__:
+            length = self._field_size(f, self.__field_info__[f])
+            if f == fname:
+                return (offset, length)
+            offset += length
+
+    @classmethod
+    def as_ctypes(cls):
+        """Returns an equivalent ``ctypes`` structure class, for classes
+        with a fixed layout. See ``dumpy.cstruct``.
+        """
+        from . import cstruct
+        return cstruct.as_ctypes(cls)
+
+    def to_ctypes(self):
+        from . import cstruct
+        return cstruct.to_ctypes(self)
+
+    @classmethod
+    def from_ctypes(cls, cobj):
+        from . import cstruct
+        return cstruct.from_ctypes(cls, cobj)
+
+
+class Backend:
+    """The engine that packs and unpacks a composite class.
+
+    Backends are selected by name, per class with a ``__backend__`` class
+    attribute, or globally with ``dumpy.config.BACKEND``. A backend that
+    doesn't support a class leaves it to the reference backend.
+    """
+
+    name = None
+
+    def supports(self, cls):
+        return True
+
+    def prepare(self, obj):
+        """Evaluate the computed defaults, before packing or sizing."""
+        obj._resolve_defaults()
+
+    def pack(self, obj):
+        raise NotImplementedError
+
+    def pack_into(self, obj, buf, offset):
+        raise NotImplementedError
+
+    def size(self, obj):
+        raise NotImplementedError
+
+    def unpack_into(self, cls, obj, buf, offset, parent):
+        """Returns the object and its end offset."""
+        raise NotImplementedError
+
+
+class ReferenceBackend(Backend):
+    """Interprets the field specs, supports every composite class."""
+
+    name = 'reference'
+
+    def pack(self, obj):
+        return obj._ref_pack()
+
+    def pack_into(self, obj, buf, offset):
+        obj._ref_pack_into(buf, offset)
+
+    def size(self, obj):
+        return obj._ref_size()
+
+    def unpack_into(self, cls, obj, buf, offset, parent):
+        return cls._ref_unpack_into(obj, buf, offset, parent)
+
+
+_BACKENDS = {}
+
+
+def register_backend(backend):
+    _BACKENDS[backend.name] = backend
+    return backend
 
-            if isinstance(val, list):
-                for v in val:
-                    size += self._safe_size(v, ftype)
-            else:
-                size += self._safe_size(val, ftype)
-        return size
+
+def get_backend(name):
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        # Registers the accelerated backends shipped with dumpy
+        from . import backends
+
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown backend {}'.format(repr(name)))
+
+
+def _backend_for(cls):
+    backend = get_backend(getattr(cls, '__backend__', None) or config.BACKEND)
+    if backend.supports(cls):
+        return backend
+    return _BACKENDS['reference']
+
+
+register_backend(ReferenceBackend())
+
+
+def _is_validated(obj):
+    return obj._validated
+
+
+def _has_validators(tp):
+    """Whether unpacking ``tp`` objects may run validators."""
+    if not (isinstance(tp, type) and issubclass(tp, CompositeStructMixin)):
+        return False
+    try:
+        return tp.__dict__['__has_validators__']
+    except KeyError:
+        pass
+
+    # Set first, in case the class is nested in itself
+    tp.__has_validators__ = True
+    found = False
+    for finfo in tp.__field_info__.values():
+        # The types of variable fields are only known when unpacking
+        if finfo.validator is not None or \
+                isinstance(finfo.tp, VariableType) or \
+                _has_validators(finfo.tp):
+            found = True
+            break
+    tp.__has_validators__ = found
+    return found
+
+
+def _reads_parent(tp):
+    """Whether objects of ``tp`` may read the enclosing objects, through
+    contextual callables that don't declare what they depend on."""
+    if not (isinstance(tp, type) and issubclass(tp, CompositeStructMixin)):
+        return False
+    try:
+        return tp.__dict__['__reads_parent__']
+    except KeyError:
+        pass
+
+    # Set first, in case the class is nested in itself
+    tp.__reads_parent__ = False
+    reads = False
+    for fname in tp.__fields__:
+        finfo = tp.__field_info__[fname]
+        funcs = []
+        if callable(finfo.count) and not isinstance(finfo.count, Terminator):
+            funcs.append((finfo.count, finfo.count))
+        if isinstance(finfo.tp, VariableType):
+            funcs.append((finfo.tp._get_type, finfo.tp))
+        elif isinstance(finfo.tp, type) and \
+                issubclass(finfo.tp, Compressed) and \
+                callable(finfo.tp.__length__):
+            funcs.append((finfo.tp.__length__, finfo.tp.__length__))
+        elif _reads_parent(finfo.tp):
+            reads = True
+        for func, decl in funcs:
+            if getattr(func, 'contextual', False) and \
+                    getattr(decl, 'depends', None) is None:
+                reads = True
+    tp.__reads_parent__ = reads
+    return reads
+
+
+def _fixed_size_of(tp):
+    if issubclass(tp, CompositeStructMixin):
+        return tp.__fixed_size__
+    if issubclass(tp, Compressed):
+        return None
+    return tp.__struct__.size
 
 
 class DumpyMeta(type):
@@ -354,7 +2066,13 @@ class DumpyMeta(type):
             fmt = clsdict['__spec__']
         except KeyError:
             # No meta data, do not process this class
-            return super().__new__(cls, clsname, bases, clsdict)
+            new_cls = super().__new__(cls, clsname, bases, clsdict)
+            if issubclass(new_cls, PrimitiveStructMixin) and \
+                    issubclass(new_cls, int):
+                # Subclasses of primitive types need instances of their own
+                new_cls.__flyweights__ = ()
+                cls._new_flyweights(new_cls)
+            return new_cls
 
         if extra_base not in bases:
             bases = (extra_base,) + bases
@@ -362,7 +2080,32 @@ class DumpyMeta(type):
         fmt = cls._normalize_format(fmt, clsdict)
         clsdict['__struct__'] = struct.Struct(fmt)
 
-        return super().__new__(cls, clsname, bases, clsdict)
+        new_cls = super().__new__(cls, clsname, bases, clsdict)
+        if extra_base is PrimitiveStructMixin and issubclass(new_cls, int):
+            cls._new_flyweights(new_cls)
+        return new_cls
+
+    def _new_flyweights(new_cls):
+        fmt = new_cls.__struct__.format
+        if isinstance(fmt, bytes):
+            fmt = fmt.decode()
+        code = fmt[-1]
+        if len(fmt) != 2 or code not in 'bBhHiIlLqQ':
+            return
+
+        bit_len = new_cls.__struct__.size * 8
+        if code.islower():
+            low, high = -(1 << (bit_len - 1)), 1 << (bit_len - 1)
+        else:
+            low, high = 0, 1 << bit_len
+        if new_cls.__struct__.size > 1:
+            low = max(low, FLYWEIGHT_RANGE[0])
+            high = min(high, FLYWEIGHT_RANGE[1])
+        if low >= high:
+            return
+
+        new_cls.__flyweights__ = tuple(new_cls(v) for v in range(low, high))
+        new_cls.__flyweight_base__ = low
 
     def _new_primitive(cls, clsname, bases, clsdict):
         return cls._new_simple(
@@ -373,15 +2116,31 @@ class DumpyMeta(type):
             cls, clsname, bases, clsdict, SequenceStructMixin)
 
     def _new_composite(cls, clsname, bases, clsdict):
-        try:
-            fields = clsdict['__field_specs__']
-        except KeyError:
+        if '__field_specs__' not in clsdict:
             # No meta data, do not process this class
             return super().__new__(cls, clsname, bases, clsdict)
 
+        # Field specs are compiled on first use, see ``_compile``
+        for attr in _COMPILED_ATTRS:
+            clsdict[attr] = _CompiledAttr(attr)
+
+        if CompositeStructMixin not in bases:
+            bases = (CompositeStructMixin,) + bases
+
+        new_cls = super().__new__(cls, clsname, bases, clsdict)
+        return new_cls
+
+    def _compile(cls):
         __fields__ = []
         __field_info__ = {}
-        for f in fields:
+        for f in cls.__field_specs__:
+            if isinstance(f, BitGroup):
+                __fields__.append(f.name)
+                __field_info__[f.name] = FieldInfo(f.name, f.tp, 1, f, None)
+                for m in f.members:
+                    __field_info__[m.name] = m
+                continue
+
             fname = f[0]
             __fields__.append(fname)
 
@@ -392,6 +2151,8 @@ class DumpyMeta(type):
                 count = ff.pop(0)
             except IndexError:
                 count = 1
+            if isinstance(count, Terminator):
+                count = count.bind(fname)
 
             try:
                 default = ff.pop(0)
@@ -406,14 +2167,110 @@ class DumpyMeta(type):
             __field_info__[fname] = \
                 FieldInfo(fname, ftype, count, default, validator)
 
-        clsdict['__fields__'] = __fields__
-        clsdict['__field_info__'] = __field_info__
+        # Fields up to the first dynamically sized one have static offsets
+        fixed_size = 0
+        offsets = {}
+        for fname in __fields__:
+            finfo = __field_info__[fname]
+            offsets[fname] = fixed_size
+            if callable(finfo.count) or isinstance(finfo.tp, VariableType):
+                fixed_size = None
+                break
+            elif finfo.count <= 0:
+                continue
+            elem_size = _fixed_size_of(finfo.tp)
+            if elem_size is None:
+                fixed_size = None
+                break
+            fixed_size += elem_size * finfo.count
+
+        for fname, finfo in __field_info__.items():
+            if isinstance(finfo.tp, BitInfo) and \
+                    finfo.tp.group.name in offsets:
+                offsets[fname] = offsets[finfo.tp.group.name]
+
+        # Fields that skip() has to decode
+        skip_needed = set()
+        for i, fname in enumerate(__fields__):
+            finfo = __field_info__[fname]
+            dynamic = []
+            if callable(finfo.count) and \
+                    not isinstance(finfo.count, Terminator):
+                dynamic.append(finfo.count)
+            if isinstance(finfo.tp, VariableType):
+                dynamic.append(finfo.tp)
+            elif isinstance(finfo.tp, type) and \
+                    issubclass(finfo.tp, Compressed) and \
+                    callable(finfo.tp.__length__):
+                dynamic.append(finfo.tp.__length__)
+            for d in dynamic:
+                deps = getattr(d, 'depends', None)
+                if deps is None:
+                    skip_needed.update(__fields__[:i])
+                    continue
+                for dep in deps:
+                    dep_info = __field_info__.get(dep)
+                    if dep_info is not None and \
+                            isinstance(dep_info.tp, BitInfo):
+                        dep = dep_info.tp.group.name
+                    skip_needed.add(dep)
+
+        # Fields with computed defaults, each one after the others it
+        # depends on
+        pending = []
+        for fname in __fields__:
+            finfo = __field_info__[fname]
+            if finfo.default is NoDefault or \
+                    isinstance(finfo.default, BitGroup) or \
+                    not callable(finfo.default):
+                continue
+            if callable(finfo.count) or finfo.count <= 0:
+                continue
+            pending.append(fname)
+        computed = []
+        while pending:
+            for fname in pending:
+                deps = getattr(__field_info__[fname].default, 'depends', ())
+                if not any(d != fname and d in pending for d in deps):
+                    break
+            else:
+                raise ValueError(
+                    'Circular dependencies between the defaults of {}'.format(
+                        ', '.join(repr(f) for f in pending)))
+            pending.remove(fname)
+            computed.append(fname)
+
+        cls.__fields__ = __fields__
+        cls.__field_info__ = __field_info__
+        cls.__fixed_size__ = fixed_size
+        cls.__skip_needed__ = frozenset(skip_needed)
+        cls.__offsets__ = offsets
+        cls.__computed__ = computed
 
-        if CompositeStructMixin not in bases:
-            bases = (CompositeStructMixin,) + bases
 
-        new_cls = super().__new__(cls, clsname, bases, clsdict)
-        return new_cls
+class _CompiledAttr:
+    """Placeholder for class attributes produced by ``DumpyMeta._compile``.
+
+    The first lookup compiles the class and replaces all placeholders.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, owner):
+        DumpyMeta._compile(owner)
+        return owner.__dict__[self.name]
+
+
+_COMPILED_ATTRS = ('__fields__', '__field_info__', '__fixed_size__',
+                   '__skip_needed__', '__offsets__', '__computed__')
+
+
+def prepare(*classes):
+    """Compile composite classes ahead of their first use."""
+    for c in classes:
+        if isinstance(c.__dict__.get('__fields__'), _CompiledAttr):
+            DumpyMeta._compile(c)
 
 
 class Int8(int, metaclass=DumpyMeta):